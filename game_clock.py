@@ -0,0 +1,129 @@
+# game_clock.py
+# 描画・判定・MIDI 再生で共有する時計と、出力デバイスごとの遅延補正
+import os
+import json
+import time
+import threading
+
+_LATENCY_FILE = os.environ.get("BREAKGATE_LATENCY_FILE") or os.path.join(
+    os.path.expanduser("~"), ".breakgate", "output_latency.json"
+)
+_latency_lock = threading.Lock()
+
+CALIBRATION_MIN_SAMPLES = 20     # これ未満のヒット数では自動補正しない
+CALIBRATION_WEIGHT = 0.5         # 既存値と新しい測定値の混ぜ具合
+CALIBRATION_LIMIT = 0.5          # 補正値の上限（秒）
+
+
+class GameClock:
+    """
+    perf_counter 基準の共有時計。
+      elapsed()       : start() からの経過秒（描画・判定はこれを使う）
+      audio_start()   : 曲の 0 秒を送出すべき clock 時刻（lead_in − 出力遅延）
+    output_latency は「送ってから聞こえるまで」の秒。音はそのぶん早めに送る。
+    """
+    def __init__(self, lead_in=0.0, output_latency=0.0, now=time.perf_counter):
+        self.lead_in = float(lead_in)
+        self.output_latency = float(output_latency)
+        self.now = now
+        self.started_at = None
+
+    def start(self, at=None, offset=0.0):
+        """at（clock 時刻）に経過 offset 秒の状態から始める（途中から再生するとき offset > 0）。"""
+        self.started_at = (self.now() if at is None else at) - offset
+        return self.started_at
+
+    def elapsed(self, t=None):
+        if self.started_at is None:
+            return 0.0
+        return (self.now() if t is None else t) - self.started_at
+
+    def audio_start(self):
+        return self.started_at + self.lead_in - self.output_latency
+
+
+class EventTimeMapper:
+    """
+    OS の入力イベント時刻（QKeyEvent.timestamp() など。ms・起点は不明）を clock 時刻へ写す。
+    配送遅れは必ず正なので「受信時の clock − イベント時刻」の最小値が真の差に一番近い。
+    """
+    RESYNC_SEC = 1.0      # これ以上ずれたら時計の巻き戻り・ラップとみなして取り直す
+    CREEP = 0.01          # 時計どうしのドリフトに追従するため、上側へはゆっくり寄せる
+
+    def __init__(self, now=time.perf_counter):
+        self.now = now
+        self.offset = None
+
+    def map(self, event_ms):
+        now = self.now()
+        if not event_ms:
+            return now        # タイムスタンプを出さない環境
+        cand = now - event_ms / 1000.0
+        if self.offset is None or cand < self.offset or cand - self.offset > self.RESYNC_SEC:
+            self.offset = cand
+        else:
+            self.offset += (cand - self.offset) * self.CREEP
+        return min(now, event_ms / 1000.0 + self.offset)
+
+
+# ====== 出力デバイスごとの遅延（秒）を保存 ======
+def _read_latency_table():
+    try:
+        with open(_LATENCY_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception:
+        return {}
+
+
+def load_output_latency(device_name, default=0.0) -> float:
+    """デバイス名に対して保存されている遅延補正（秒）。無ければ default。"""
+    if not device_name:
+        return default
+    with _latency_lock:
+        v = _read_latency_table().get(device_name)
+    try:
+        return float(v) if v is not None else default
+    except (TypeError, ValueError):
+        return default
+
+
+def save_output_latency(device_name, seconds):
+    if not device_name:
+        return
+    seconds = max(-CALIBRATION_LIMIT, min(CALIBRATION_LIMIT, float(seconds)))
+    with _latency_lock:
+        table = _read_latency_table()
+        table[device_name] = round(seconds, 4)
+        try:
+            os.makedirs(os.path.dirname(_LATENCY_FILE), exist_ok=True)
+            tmp = _LATENCY_FILE + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(table, f, ensure_ascii=False, indent=1)
+            os.replace(tmp, _LATENCY_FILE)
+        except Exception:
+            pass
+
+
+def estimate_latency_from_offsets(offsets):
+    """
+    ヒット時のズレ（押した時刻 − 判定時刻, 秒, 正=遅押し）の中央値。
+    音に合わせて叩く人は、音が遅れて聞こえるぶんだけ遅れて押すので、これが追加の補正量になる。
+    サンプルが少なければ None。
+    """
+    if len(offsets) < CALIBRATION_MIN_SAMPLES:
+        return None
+    s = sorted(offsets)
+    mid = len(s) // 2
+    return s[mid] if len(s) % 2 else (s[mid - 1] + s[mid]) / 2.0
+
+
+def update_output_latency(device_name, offsets):
+    """1プレイぶんのズレから、そのデバイスの遅延補正を更新する。"""
+    est = estimate_latency_from_offsets(offsets)
+    if est is None or not device_name:
+        return None
+    cur = load_output_latency(device_name)
+    new = cur + CALIBRATION_WEIGHT * est
+    save_output_latency(device_name, new)
+    return new
@@ -6,8 +6,10 @@ import random
 import subprocess
 from PyQt5.QtWidgets import QApplication, QWidget, QLabel, QPushButton, QVBoxLayout, QInputDialog, QFileDialog
 from PyQt5.QtCore import Qt, QTimer,QObject,QEventLoop
-from qt_midi_game import MidiGame
-from midi_utils import list_midi_output_devices, pick_default_midi_out_id, open_output_or_none
+from qt_midi_game import MidiGameLoader
+from song_browser import SongTable, song_scanner
+from song_preview import PreviewPlayer, preview_cache, PREFETCH_NEIGHBORS
+from midi_utils import list_midi_output_devices, pick_default_midi_out_id, midi_device_cache
 
 # 追加：クロスプラットフォームWindowユーティリティ
 from xplatform_window import (
@@ -20,13 +22,24 @@ from PyQt5.QtCore import Qt
 from qt_tetris_game import TetrisGame
 from PyQt5.QtGui import QGuiApplication, QCursor
 from PyQt5.QtWidgets import (
-    QWidget, QVBoxLayout, QHBoxLayout, QListWidget, QPushButton, QLabel, QFileDialog, QComboBox
+    QWidget, QVBoxLayout, QHBoxLayout, QListWidget, QPushButton, QLabel, QFileDialog, QComboBox,
+    QProgressBar, QLineEdit
 )
 from PyQt5.QtCore import Qt, QTimer, QThread, pyqtSignal
 # ===== MIDI 出力ユーティリティ =====
-import pygame.midi
 import platform
 import shutil
+
+# 作業タイマーの残りがこの秒数になったら、休憩用のゲームを裏で準備しておく
+PREWARM_SEC = float(os.environ.get("BREAKGATE_PREWARM_SEC", "15"))
+
+
+def music_dirs():
+    """曲フォルダ：このスクリプトの横とカレントの 'music'"""
+    return [os.path.join(os.path.dirname(os.path.abspath(__file__)), "music"),
+            os.path.join(os.getcwd(), "music")]
+
+
 # --- mac の .app を正規化するヘルパー ---
 def normalize_to_app_bundle(path: str) -> str:
     p = path
@@ -484,39 +497,9 @@ from PyQt5.QtWidgets import QDialog, QListWidget, QHBoxLayout, QComboBox
 from PyQt5.QtCore import QEventLoop, QThread, pyqtSignal
 import mido
 
-class _PreviewThread(QThread):
-    finished_once = pyqtSignal()
-
-    def __init__(self, midi_path, out_id, seconds=8, parent=None):
-        super().__init__(parent)
-        self.midi_path = midi_path
-        self.out_id = out_id
-        self.seconds = seconds
-        self._stop = False
-
-    def stop(self):
-        self._stop = True
-
-    def run(self):
-        try:
-            if self.out_id == -1:
-                return
-            pygame.midi.init()
-            out = pygame.midi.Output(self.out_id)
-            start = time.time()
-            for msg in mido.MidiFile(self.midi_path).play(meta_messages=True):
-                if self._stop or (time.time() - start) > self.seconds:
-                    break
-                if msg.type in ("note_on", "note_off"):
-                    status = 0x90 if msg.type == "note_on" else 0x80
-                    note = getattr(msg, "note", 0)
-                    vel = getattr(msg, "velocity", 0)
-                    out.write_short(status, note, vel)
-            out.close()
-        except Exception:
-            pass
-        finally:
-            self.finished_once.emit()
+class _DeviceListSignal(QObject):
+    """デバイス一覧の変更通知を GUI スレッドへ渡すためのシグナル"""
+    changed = pyqtSignal(object)
 # ---- 追加・置き換え：試聴なしの超シンプル選曲UI ----
 from PyQt5.QtWidgets import QDialog, QListWidget, QHBoxLayout, QComboBox, QFileDialog, QVBoxLayout, QPushButton, QLabel
 from PyQt5.QtCore import Qt
@@ -543,10 +526,18 @@ class SimpleSongSelectDialog(QDialog):
 
         root = QHBoxLayout(self)
 
-        # 左：曲リスト
-        self.list = QListWidget(self)
-        self.list.itemDoubleClicked.connect(self.accept)  # ダブルクリックで確定
-        root.addWidget(self.list, 2)
+        # 左：検索欄と曲リスト
+        left = QVBoxLayout()
+        self.search = QLineEdit(self)
+        self.search.setPlaceholderText("検索（曲名・フォルダ・トラック名・BPM）")
+        self.search.setClearButtonEnabled(True)
+        left.addWidget(self.search)
+        self.list = SongTable(self)
+        self.list.songActivated.connect(lambda _: self._on_ok())  # ダブルクリックで確定
+        self.search.textChanged.connect(self.list.set_filter)
+        self.finished.connect(lambda _: self.list.stop_indexing())
+        left.addWidget(self.list)
+        root.addLayout(left, 3)
 
         # 右：コントロール
         right = QVBoxLayout()
@@ -555,24 +546,30 @@ class SimpleSongSelectDialog(QDialog):
         # 難易度
         self.diff = QComboBox(self)
         self.diff.addItems(["Easy", "Normal", "Hard"])
+        self.diff.currentTextChanged.connect(self.list.set_difficulty)   # 密度の列の並べ替えに使う
+        self.list.set_difficulty(self.diff.currentText())
         right.addWidget(QLabel("難易度:", self))
         right.addWidget(self.diff)
 
-        # MIDI出力デバイス選択
+        # MIDI出力デバイス選択（一覧は起動時にバックグラウンドで取得済みのキャッシュ）
         self.out_combo = QComboBox(self)
         right.addWidget(QLabel("MIDI 出力:", self))
         self._id_by_index = []
-        sel_index = 0
+        self._name_by_index = []
         outs = self._list_midi_outs() if self._list_midi_outs else []
         default_id = self._pick_default_id() if self._pick_default_id else -1
-        for idx, (pid, pname) in enumerate(outs):
-            self.out_combo.addItem(f"[{pid}] {pname}")
-            self._id_by_index.append(pid)
-            if pid == default_id:
-                sel_index = idx
-        if outs:
-            self.out_combo.setCurrentIndex(sel_index)
+        self._fill_outputs(outs, default_id)
         right.addWidget(self.out_combo)
+        btn_rescan = QPushButton("デバイスを再検索", self)
+        btn_rescan.clicked.connect(lambda: midi_device_cache().refresh_async())
+        right.addWidget(btn_rescan)
+
+        # 抜き差しなどで一覧が変わったら差し替える（通知は取得スレッドから来るのでシグナル経由）
+        self._devices_changed = _DeviceListSignal(self)
+        self._devices_changed.changed.connect(self._on_devices_changed)
+        self._devices_cb = self._devices_changed.changed.emit
+        midi_device_cache().subscribe(self._devices_cb)
+        self.finished.connect(lambda _: midi_device_cache().unsubscribe(self._devices_cb))
 
         # 操作ボタン
         btn_add = QPushButton("ファイルを追加…", self)
@@ -585,13 +582,8 @@ class SimpleSongSelectDialog(QDialog):
         right.addWidget(btn_cancel)
         right.addStretch(1)
 
-        # 初期リスト投入
-        self._seen = set()
-        for folder in (seed_dirs or []):
-            if folder and os.path.isdir(folder):
-                for name in os.listdir(folder):
-                    if name.lower().endswith((".mid", ".midi")):
-                        self._add_path(os.path.join(folder, name))
+        # 初期リスト投入（フォルダは走査器の一覧から、長さ・BPM などはライブラリ索引から）
+        self.list.follow(seed_dirs or [])
 
         # 結果フィールド
         self.selected_path = None
@@ -605,12 +597,32 @@ class SimpleSongSelectDialog(QDialog):
 
         # 最初の項目を選択状態に
         if self.list.count() > 0:
-            self.list.setCurrentRow(0)
+            self.list.set_current_row(0)
+
+    def _fill_outputs(self, outs, select_id):
+        self.out_combo.clear()
+        self._id_by_index = []
+        self._name_by_index = []
+        sel_index = 0
+        for idx, (pid, pname) in enumerate(outs):
+            self.out_combo.addItem(f"[{pid}] {pname}")
+            self._id_by_index.append(pid)
+            self._name_by_index.append(pname)
+            if pid == select_id:
+                sel_index = idx
+        if outs:
+            self.out_combo.setCurrentIndex(sel_index)
+
+    def _on_devices_changed(self, outs):
+        # PortMidi を初期化し直すと ID がずれるので、選択は名前で引き継ぐ
+        keep_name = self._current_out_name()
+        keep = next((pid for pid, pname in outs if pname == keep_name), None)
+        if keep is None:
+            keep = self._pick_default_id() if self._pick_default_id else -1
+        self._fill_outputs(outs, keep)
 
     def _add_path(self, p):
-        if p and p not in self._seen:
-            self._seen.add(p)
-            self.list.addItem(p)
+        self.list.add_path(p)
 
     def _current_out_id(self):
         if not self._id_by_index:
@@ -620,6 +632,12 @@ class SimpleSongSelectDialog(QDialog):
             return self._id_by_index[i]
         return -1
 
+    def _current_out_name(self):
+        i = self.out_combo.currentIndex()
+        if 0 <= i < len(self._name_by_index):
+            return self._name_by_index[i]
+        return None
+
     def _on_add_file(self):
         path, _ = QFileDialog.getOpenFileName(
             self, "MIDIファイルを選択", "", "MIDI Files (*.mid *.midi)"
@@ -627,15 +645,13 @@ class SimpleSongSelectDialog(QDialog):
         if path:
             self._add_path(path)
             # 追加した曲を選択
-            items = self.list.findItems(path, Qt.MatchExactly)
-            if items:
-                self.list.setCurrentItem(items[0])
+            self.list.set_current_path(path)
 
     def _on_ok(self):
-        item = self.list.currentItem()
-        if not item:
+        path = self.list.current_path()
+        if not path:
             return
-        self.selected_path = item.text()
+        self.selected_path = path
         self.selected_diff = self.diff.currentText()
         self.selected_out_id = self._current_out_id()
         self.accept()
@@ -651,14 +667,24 @@ class SongSelectDialog(QDialog):
         # 左：曲リスト、右：操作
         root = QHBoxLayout(self)
 
-        self.list = QListWidget(self)
-        root.addWidget(self.list, 2)
+        left = QVBoxLayout()
+        self.search = QLineEdit(self)
+        self.search.setPlaceholderText("検索（曲名・フォルダ・トラック名・BPM）")
+        self.search.setClearButtonEnabled(True)
+        left.addWidget(self.search)
+        self.list = SongTable(self)
+        self.search.textChanged.connect(self.list.set_filter)
+        self.finished.connect(lambda _: self.list.stop_indexing())
+        left.addWidget(self.list)
+        root.addLayout(left, 3)
 
         right = QVBoxLayout()
         root.addLayout(right, 1)
 
         # 難易度
         self.diff = QComboBox(self); self.diff.addItems(["Easy","Normal","Hard"])
+        self.diff.currentTextChanged.connect(self.list.set_difficulty)
+        self.list.set_difficulty(self.diff.currentText())
         right.addWidget(QLabel("難易度:", self))
         right.addWidget(self.diff)
 
@@ -687,26 +713,17 @@ class SongSelectDialog(QDialog):
         right.addWidget(btn_cancel)
         right.addStretch(1)
 
-        # 候補一覧を埋める
-        paths = []
-        for folder in (seed_dirs or []):
-            if folder and os.path.isdir(folder):
-                for name in os.listdir(folder):
-                    if name.lower().endswith((".mid",".midi")):
-                        paths.append(os.path.join(folder, name))
-        # 重複は除去
-        seen = set()
-        for p in paths:
-            if p not in seen:
-                self.list.addItem(p)
-                seen.add(p)
+        # 候補一覧を埋める（走査中なら見つかったものから並ぶ）
+        self.list.follow(seed_dirs or [])
 
         # フィールド
         self.selected_path = None
         self.selected_diff = "Normal"
         self.selected_out_id = default_id
-        self._preview_th = None
-        self._midi_inited=False
+        # 試聴：曲頭の切り出しはプロセスで共有のキャッシュ、出力は閉じるまで開いたまま
+        self._preview = PreviewPlayer(preview_cache())
+        self.list.currentPathChanged.connect(self._on_current_song)
+        self._on_current_song(self.list.current_path())
 
         # イベント
         btn_preview.clicked.connect(self._on_preview)
@@ -720,58 +737,45 @@ class SongSelectDialog(QDialog):
         return self._id_by_index[i] if 0 <= i < len(self._id_by_index) else -1
 
     def _on_preview(self):
-        item = self.list.currentItem()
-        if not item:
+        path = self.list.current_path()
+        if not path:
             return
-        path = item.text()
         out_id = self._current_out_id()
-        # 既存プレビューを止める
-        if self._preview_th and self._preview_th.isRunning():
-            self._preview_th.stop(); self._preview_th.wait(300)
-        # 新規プレビュー
-        if not self._midi_inited:
-            try:
-                pygame.midi.init()
-                self._midi_inited = True
-            except Exception:
-                pass
-        self._preview_th = _PreviewThread(path, out_id, seconds=8, parent=self)
-        self._preview_th.finished_once.connect(lambda: None)
-        self._preview_th.start()
+        if out_id == -1:
+            return
+        # 鳴っている試聴があれば止めてすぐ切り替わる（デバイスは開き直さない）
+        self._preview.play(path, out_id)
+
+    def _on_current_song(self, path):
+        if not path:
+            return
+        # 前後の曲を先読みしておく。試聴中なら選んだ曲へ切り替える
+        self._preview.cache.prefetch([path] + self.list.neighbor_paths(PREFETCH_NEIGHBORS))
+        if self._preview.is_playing() and self._preview.current_path() != path:
+            self._on_preview()
 
     def _on_ok(self):
-        item = self.list.currentItem()
-        if not item:
+        path = self.list.current_path()
+        if not path:
             return
-        self.selected_path = item.text()
+        self.selected_path = path
         self.selected_diff = self.diff.currentText()
         self.selected_out_id = self._current_out_id()
         # プレビュー止めて閉じる
-        if self._preview_th and self._preview_th.isRunning():
-            self._preview_th.stop(); self._preview_th.wait(300)
-        self.accept()
         self._cleanup_midi()
         self.accept()
  
     def _cleanup_midi(self):
         try:
-            if self._preview_th and self._preview_th.isRunning():
-                self._preview_th.stop(); self._preview_th.wait(300)
-        except Exception:
-            pass
-        try:
-            if self._midi_inited:
-                pygame.midi.quit()
-                self._midi_inited = False
+            self._preview.close()   # 出力をブローカーへ返す
         except Exception:
             pass
 
+    def done(self, r):
+        self._cleanup_midi()
+        super().done(r)
+
     def closeEvent(self, e):
-        try:
-            if self._preview_th and self._preview_th.isRunning():
-                self._preview_th.stop(); self._preview_th.wait(300)
-        except Exception:
-            pass
         self._cleanup_midi()
         super().closeEvent(e)
 
@@ -831,6 +835,49 @@ class FinishBreakWindow(QWidget):
 
 
 
+class LoadingWindow(QWidget):
+    """音ゲーの組み立て中に出す小さな進捗表示。×で閉じると読み込みを取り消す。"""
+    def __init__(self, on_cancel=None, screen=None, parent=None):
+        super().__init__(parent)
+        self._on_cancel = on_cancel
+        self._quiet = False
+        self.setWindowTitle("読み込み中")
+        self.setWindowFlags(Qt.WindowStaysOnTopHint | Qt.Tool | Qt.WindowTitleHint | Qt.WindowCloseButtonHint)
+        self.setAttribute(Qt.WA_ShowWithoutActivating, True)
+
+        self.label = QLabel("準備中…", self)
+        self.label.setStyleSheet("font-size: 20px;")
+        self.bar = QProgressBar(self)
+        self.bar.setRange(0, 1)
+        self.bar.setValue(0)
+
+        lay = QVBoxLayout(self)
+        lay.addWidget(self.label)
+        lay.addWidget(self.bar)
+        self.setFixedSize(420, 120)
+
+        scr = screen or QGuiApplication.primaryScreen()
+        g = scr.availableGeometry()
+        self.move(g.right() - self.width() - 12, g.top() + 12)
+
+    def set_progress(self, step, total, text):
+        self.bar.setRange(0, total)
+        self.bar.setValue(step)
+        self.label.setText(f"{text}…（{step}/{total}）")
+
+    def close_quietly(self):
+        self._quiet = True
+        self.close()
+
+    def closeEvent(self, e):
+        if not self._quiet and callable(self._on_cancel):
+            try:
+                self._on_cancel()
+            except Exception:
+                pass
+        super().closeEvent(e)
+
+
 class PomodoroGameLauncher(QWidget):
     def __init__(self):
         super().__init__()
@@ -842,6 +889,10 @@ class PomodoroGameLauncher(QWidget):
         self._rest_ended_at = None   # 休憩タイマーが0になった時刻
         self.session_round = 0  # 何回目のセッションか
         self.preview=PreviewController(parent=self)
+        midi_device_cache().start()   # MIDI 出力の一覧は裏で取っておく（選曲ダイアログを待たせない）
+        song_scanner().start(music_dirs())   # 曲フォルダも裏で走査して監視しておく
+        self._game_loader = None      # 音ゲーの組み立て（作業中の事前準備を含む）
+        self._loading_win = None
         
     def _shutdown_all(self):
         """終了時の後始末を一箇所に集約"""
@@ -969,6 +1020,7 @@ class PomodoroGameLauncher(QWidget):
         # プレビュー停止（残っていたら）
         if hasattr(self, 'preview') and self.preview:
             self.preview.stop()
+        self._cancel_game_loader()
 
         for name in ('game_window', 'tetris_window'):
             w = getattr(self, name, None)
@@ -1144,7 +1196,8 @@ class PomodoroGameLauncher(QWidget):
         if not finish_cb:
             self._cancel_to_home(); return
 
-        self.timer_win = TimerWindow(self.work_duration, lambda: self._on_work_timer_finish(finish_cb))
+        self.timer_win = TimerWindow(self.work_duration, lambda: self._on_work_timer_finish(finish_cb),
+                                     prewarm_cb=self._prewarm_break)
         self.timer_win.show()
         self.hide()
     def _on_work_timer_finish(self, cb):
@@ -1159,26 +1212,10 @@ class PomodoroGameLauncher(QWidget):
         if p and os.path.isfile(p):
             return p
 
-        # 2) このスクリプトとカレントの 'music' を探す
-        candidates = []
-        for folder in (os.path.join(os.path.dirname(__file__), "music"),
-                       os.path.join(os.getcwd(), "music")):
-            if os.path.isdir(folder):
-                for name in os.listdir(folder):
-                    if name.lower().endswith((".mid", ".midi")):
-                        candidates.append(os.path.join(folder, name))
-
+        # 2) 'music' フォルダ（配下も含む）の走査結果から。走査がまだなら少しだけ待つ
+        candidates = list(song_scanner().files(music_dirs(), wait=1.0))
         if candidates:
-            try:
-                return candidates[0]   # デモはランダム
-            except Exception:
-                return candidates[0]              # 念のため先頭
-
-        # 3) 見つからなければプロジェクト配下をざっと探索（最初に見つかった1件）
-        for root, _, files in os.walk(os.path.dirname(__file__)):
-            for name in files:
-                if name.lower().endswith((".mid", ".midi")):
-                    return os.path.join(root, name)
+            return candidates[0]
 
         return None
         
@@ -1197,14 +1234,9 @@ class PomodoroGameLauncher(QWidget):
 
         if self.mode == "音楽ゲーム":
             # 曲選択ダイアログを開く
-            import os
-            seed = [
-                os.path.join(os.path.dirname(__file__), "music"),
-                os.path.join(os.getcwd(), "music")
-            ]
             dlg = SimpleSongSelectDialog(
                     parent=self,
-                    seed_dirs=seed,
+                    seed_dirs=music_dirs(),
                     list_midi_output_devices_func=list_midi_output_devices,
                     pick_default_midi_out_id_func=pick_default_midi_out_id
             )
@@ -1313,7 +1345,7 @@ class PomodoroGameLauncher(QWidget):
             if not finish_cb:
                 self._cancel_to_home(); return
 
-            self.timer_win = TimerWindow(self.work_duration, finish_cb)
+            self.timer_win = TimerWindow(self.work_duration, finish_cb, prewarm_cb=self._prewarm_break)
             self.timer_win.show()
             self.close()
         else:
@@ -1346,30 +1378,94 @@ class PomodoroGameLauncher(QWidget):
     def start_work_timer(self):
         pass
 
+    # ====== 休憩ゲームの事前準備（作業タイマーの残り PREWARM_SEC 秒から） ======
+    def _game_key(self):
+        # 出力が未指定なら None のまま（既定のデバイスは組み立てスレッドで決める。一覧の取得を GUI で待たない）
+        out_id = getattr(self, "midi_out_id", None)
+        return (getattr(self, "midi_path", None), getattr(self, "difficulty", "Normal"), out_id)
+
+    def _prewarm_break(self, remaining=None):
+        """作業中のうちに音ゲーを組み立てておく（曲・譜面・出力は別スレッド、窓は非表示のまま）。"""
+        if getattr(self, "mode", None) != "音楽ゲーム" or not getattr(self, "midi_path", None):
+            return
+        self._ensure_game_loader(self._game_key())
+
+    def _ensure_game_loader(self, key):
+        """key（曲・難易度・出力）の組み立てを返す。進行中・完了済みで一致すればそれを使う（失敗したものは作り直す）。"""
+        ld = self._game_loader
+        if ld is not None and ld.key == key and not ld.is_cancelled() and not ld.is_failed():
+            return ld
+        self._cancel_game_loader()
+        ld = MidiGameLoader(key[0], difficulty=key[1], midi_out_id=key[2], parent=self)
+        ld.key = key
+        self._game_loader = ld
+        ld.start()
+        return ld
+
+    def _cancel_game_loader(self):
+        ld, self._game_loader = self._game_loader, None
+        if ld is not None:
+            ld.cancel()
+            ld.dispose()
+        w, self._loading_win = self._loading_win, None
+        if w is not None:
+            try:
+                w.close_quietly()
+            except Exception:
+                pass
+
     def start_game_preview(self):
+        key = self._game_key()
+        ld = self._ensure_game_loader(key)
+        self._game_loader = None          # 下の後始末で取り消されないよう一旦外す
         self._close_game_windows()
-        try:
-            pygame.midi.quit()
-        except Exception:
-            pass
-        out_id = getattr(self, "midi_out_id", pick_default_midi_out_id())
-        # ここを preview_mode=False に
-        self.game_window = MidiGame(self.midi_path, preview_mode=False,difficulty=getattr(self,"difficulty","Normal"), midi_out_id=out_id)
-        # self.game_window.showFullScreen()
-            # MidiGame のシグネチャに合わせて安全に渡す
-        diff = getattr(self, "difficulty", "Normal")
-        try:
-            self.game_window = MidiGame(self.midi_path,
-                                    preview_mode=False,
-                                    difficulty=diff,
-                                    midi_out_id=out_id)
-        except TypeError:
-        # 古い MidiGame で引数が無い場合
-            self.game_window = MidiGame(self.midi_path, preview_mode=False)
-        
+        self._game_loader = ld
+        if ld.is_done():
+            self._show_game_preview(self._take_game(ld))
+            return
+        if ld.is_failed():
+            self._on_game_load_failed(ld, ld.error)
+            return
+        # まだ組み立て中：進み具合を出して、できた時点でプレビューへ
+        self._loading_win = LoadingWindow(on_cancel=self._cancel_loading, screen=self._target_screen())
+        ld.progress.connect(self._loading_win.set_progress)
+        ld.ready.connect(lambda game, ld=ld: self._on_game_loaded(ld))
+        ld.failed.connect(lambda msg, ld=ld: self._on_game_load_failed(ld, msg))
+        self._loading_win.show()
+
+    def _on_game_loaded(self, ld):
+        if ld is not self._game_loader or self._loading_win is None:
+            return   # 事前準備の完了（まだ作業中）か、取り消し済み
+        w, self._loading_win = self._loading_win, None
+        w.close_quietly()
+        self._show_game_preview(self._take_game(ld))
+
+    def _take_game(self, ld):
+        """組み立て済みの MidiGame を引き取り、組み立て役は片付ける（休憩ごとに溜まらないように）"""
+        if self._game_loader is ld:
+            self._game_loader = None
+        game = ld.take()
+        ld.dispose()
+        return game
+
+    def _on_game_load_failed(self, ld, msg):
+        if ld is not self._game_loader:
+            return
+        print(f"[WARN] MIDI game load failed: {msg}")
+        self._cancel_game_loader()
+        self._cancel_to_home()
+
+    def _cancel_loading(self):
+        self._loading_win = None          # 自分で閉じている最中
+        self._cancel_game_loader()
+        self._cancel_to_home()
+
+    def _show_game_preview(self, game):
+        self.game_window = game
         scr = self._target_screen()  # ★ ランチャーのいる画面
         # プレビュー（全画面・フェード）
         self.preview.start(self.game_window, fullscreen=True,screen=scr)
+        self.game_window.start()   # 再生スレッドはここで1本だけ立ち上がる
             # ★ プレビュー窓を出した“後”に、タイマーをもう一度前面へ
         QTimer.singleShot(50, lambda: getattr(self, "timer_win", None) and bring_front_noactivate(self.timer_win))
         for delay in (50, 250):
@@ -1775,7 +1871,8 @@ class PomodoroGameLauncher(QWidget):
 
 
 class TimerWindow(QWidget):
-    def __init__(self, duration, on_finish=None,exit_on_manual_close=True,screen=None,parent=None,one_minute_cb=None):
+    def __init__(self, duration, on_finish=None,exit_on_manual_close=True,screen=None,parent=None,one_minute_cb=None,
+                 prewarm_cb=None, prewarm_sec=PREWARM_SEC):
         super().__init__(parent)
         self.duration = duration
         self.on_finish = on_finish
@@ -1784,6 +1881,9 @@ class TimerWindow(QWidget):
         self._closing_programmatically = False    
         self._one_minute_cb = one_minute_cb        # ← 追加
         self._one_minute_fired = False     
+        self._prewarm_cb = prewarm_cb      # 残り prewarm_sec 秒で一度だけ（次の画面の事前準備）
+        self._prewarm_sec = prewarm_sec
+        self._prewarm_fired = False
         self.start_time = time.time()
         self.initUI()
 
@@ -1848,6 +1948,14 @@ class TimerWindow(QWidget):
                     self._one_minute_cb(max(remaining, 0))  # 残り秒数を渡す
                 except Exception:
                     pass
+
+        if (not self._prewarm_fired) and (remaining <= self._prewarm_sec):
+            self._prewarm_fired = True
+            if callable(self._prewarm_cb):
+                try:
+                    self._prewarm_cb(max(remaining, 0))
+                except Exception:
+                    pass
                 
         if remaining <= 0:
             self.timer.stop()
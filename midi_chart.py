@@ -0,0 +1,421 @@
+# midi_chart.py
+# 譜面（ノーツの時刻とレーン）の生成と、ディスク上の譜面キャッシュ
+import os
+import sys
+import time
+import mmap
+import struct
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from midi_song import MidiSong, load_song
+
+# 生成ロジックを変えたら上げる（古いキャッシュは自然に使われなくなる）
+CHART_GENERATOR_VERSION = 2
+
+LANES = 4
+BUCKET_SEC = {"Easy": 0.5, "Normal": 0.15, "Hard": 0.1}
+DIFFICULTIES = ("Easy", "Normal", "Hard")
+
+# ====== キャッシュ設定 ======
+CACHE_DIR = os.environ.get("BREAKGATE_CHART_CACHE") or os.path.join(
+    os.path.expanduser("~"), ".breakgate", "chart_cache"
+)
+# これを超えたら古いものから消す（一括生成で全曲ぶん置くなら BREAKGATE_CHART_CACHE_MB で広げる）
+CACHE_MAX_BYTES = int(float(os.environ.get("BREAKGATE_CHART_CACHE_MB", "16")) * 1024 * 1024)
+_CACHE_EXT = ".chart"
+
+# ====== 譜面ファイルの形式 ======
+# 64 バイトのヘッダのあとに、ノーツ1つ = 16 バイトの固定長レコードが時刻順に並ぶ。
+# 読むときは mmap した上に NumPy の配列をかぶせるだけ（ノーツごとの Python オブジェクトは作らない）。
+# 同じファイルを開いたゲームや試聴は、OS のページキャッシュを共有する。
+CHART_FORMAT_VERSION = 2
+_MAGIC = b"BGCH"
+# magic, 形式, 生成ロジックの版, ノーツ数, レコード長, シード, 曲の SHA-1（20 バイト）, 難易度（ASCII）
+_HEADER = struct.Struct("<4sHHIIQ20s8s12x")
+CHART_RECORD = np.dtype([
+    ("time", "<f8"),      # 秒
+    ("tick", "<u4"),      # 元の MIDI での絶対 tick
+    ("lane", "u1"),
+    ("_pad", "V3"),
+])
+
+
+# ノーツの判定状態（Chart.state の値）
+NOTE_PENDING = 0
+NOTE_HIT = 1
+NOTE_MISS = 2
+NOTE_SKIPPED = 3     # 途中から始めたときの開始位置より前（判定しない）
+
+
+class Chart:
+    """
+    譜面本体（Struct of Arrays）。
+      times : 各ノーツの時刻（秒, float64, 昇順）
+      lanes : レーン番号（uint8）
+      ticks : 元の MIDI での絶対 tick（無ければ 0）
+      state : 判定状態（NOTE_PENDING / NOTE_HIT / NOTE_MISS）
+    ファイルから読んだ譜面の times / lanes / ticks は mmap の読み取り専用ビュー。state だけが各自のもの。
+    """
+    def __init__(self, times, lanes, ticks=None):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.lanes = np.asarray(lanes, dtype=np.uint8)
+        self.ticks = np.zeros(len(self.times), dtype=np.int64) if ticks is None else np.asarray(ticks)
+        self.state = np.zeros(len(self.times), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.times)
+
+    def skip_before(self, seconds):
+        """seconds より前のノーツを判定対象から外し、最初に残るノーツの位置を返す。"""
+        k = int(np.searchsorted(self.times, seconds, side="left"))
+        self.state[:k] = NOTE_SKIPPED
+        return k
+
+    def lane_indices(self, lane):
+        """レーン lane のノーツのインデックス（時刻順）"""
+        return np.flatnonzero(self.lanes == lane)
+
+
+def file_digest(path) -> str:
+    """ファイル内容の SHA-1（キャッシュキー用）"""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def chart_seed(digest, difficulty) -> int:
+    """曲（内容のハッシュ）と難易度から決まる既定のシード。同じ曲なら毎回同じ譜面になる。"""
+    h = hashlib.sha1(f"{digest}:{difficulty}".encode("utf-8")).digest()
+    return int.from_bytes(h[:8], "little")
+
+
+def chart_cache_key(digest, difficulty, seed=None) -> str:
+    if seed is None:
+        seed = chart_seed(digest, difficulty)
+    return f"{digest}_{difficulty}_{seed:x}_v{CHART_GENERATOR_VERSION}"
+
+
+# ====== 譜面生成（時間バケツ方式） ======
+def compile_chart(note_times, difficulty="Normal", lanes=LANES, seed=0, return_index=False):
+    """
+    発音時刻の一覧から (times, lanes) を作る。times は秒の昇順（float64 配列）。
+      ・時刻を整数マイクロ秒に直してからバケツに分ける（float キーの丸め誤差を避ける）
+      ・各バケツから1つを乱数で選ぶ
+      ・レーンは同じレーンが3連続にならないように決める
+    すべて NumPy の一括処理で、同じ seed なら必ず同じ譜面になる。
+    return_index=True なら、選んだノーツの note_times での位置も返す (times, lanes, index)。
+    """
+    note_times = np.asarray(note_times, dtype=np.float64)
+    order = np.argsort(note_times, kind="stable")
+    t = note_times[order]
+    if len(t) == 0:
+        empty = (t, np.zeros(0, dtype=np.uint8))
+        return empty + (order,) if return_index else empty
+    rng = np.random.default_rng(seed)
+
+    # バケツ番号 = round(us / bucket_us)（整数演算、0.5 は切り上げ）
+    bucket_us = max(1, int(round(BUCKET_SEC.get(difficulty, 0.15) * 1e6)))
+    us = np.rint(t * 1e6).astype(np.int64)
+    b = (us + bucket_us // 2) // bucket_us
+    starts = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+    counts = np.diff(np.r_[starts, len(t)])
+    pick = starts + (rng.random(len(starts)) * counts).astype(np.int64)
+    times = t[pick]
+
+    n = len(times)
+    if lanes < 2:
+        cols = np.zeros(n, dtype=np.uint8)
+        return (times, cols, order[pick]) if return_index else (times, cols)
+    # 前のレーンからの差分 d で表す（d==0 は同じレーン）。
+    # d==0 が2つ続くと3連続になるので、0 の連なりの偶数番目（2個目, 4個目…）を 1..lanes-1 に振り直す
+    d = rng.integers(0, lanes, n)
+    zero = d == 0
+    zero[0] = False                       # d[0] は最初のレーンそのもの
+    idx = np.arange(n)
+    last_nonzero = np.maximum.accumulate(np.where(zero, -1, idx))
+    fix = zero & ((idx - last_nonzero) % 2 == 0)
+    d[fix] = rng.integers(1, lanes, int(fix.sum()))
+    cols = (np.cumsum(d) % lanes).astype(np.uint8)
+    return (times, cols, order[pick]) if return_index else (times, cols)
+
+
+def compile_song_chart(song, difficulty="Normal", lanes=LANES, seed=0):
+    """MidiSong から Chart を作る（元の tick も持たせる）"""
+    times, cols, index = compile_chart(song.note_on_times(), difficulty, lanes, seed, return_index=True)
+    return Chart(times, cols, song.note_on_ticks()[index])
+
+
+# ====== ディスクキャッシュ ======
+def _cache_path(key, cache_dir=None):
+    return os.path.join(cache_dir or CACHE_DIR, key + _CACHE_EXT)
+
+
+def load_chart_file(path, digest=None, difficulty=None, seed=None):
+    """
+    譜面ファイルを mmap で開いて Chart を返す（形式・版が違う、または digest などが合わなければ None）。
+    配列はファイルのページを直接指すので、ノーツ数によらず確保は数個で済む。
+    """
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        magic, fmt, gen, n, rec_size, file_seed, file_digest_, file_diff = _HEADER.unpack_from(mm, 0)
+        ok = (magic == _MAGIC and fmt == CHART_FORMAT_VERSION and gen == CHART_GENERATOR_VERSION
+              and rec_size == CHART_RECORD.itemsize and len(mm) >= _HEADER.size + n * rec_size
+              and (digest is None or file_digest_ == bytes.fromhex(digest))
+              and (difficulty is None or file_diff.rstrip(b"\0").decode("ascii") == difficulty)
+              and (seed is None or file_seed == seed))
+        if ok:
+            rec = np.frombuffer(mm, dtype=CHART_RECORD, count=n, offset=_HEADER.size)
+            return Chart(rec["time"], rec["lane"], rec["tick"])
+    except (struct.error, ValueError):
+        pass
+    # 使わないマップは閉じる（Windows では開いたままだと同じファイルを消せない・書き換えられない）
+    mm.close()
+    return None
+
+
+def save_chart_file(path, chart, digest, difficulty, seed):
+    """譜面ファイルを書く（一時ファイルに書いてから置き換える）。成否を返す。"""
+    try:
+        rec = np.zeros(len(chart), dtype=CHART_RECORD)
+        rec["time"] = chart.times
+        rec["lane"] = chart.lanes
+        rec["tick"] = np.clip(chart.ticks, 0, 0xFFFFFFFF)
+        header = _HEADER.pack(_MAGIC, CHART_FORMAT_VERSION, CHART_GENERATOR_VERSION, len(chart),
+                              CHART_RECORD.itemsize, seed, bytes.fromhex(digest),
+                              difficulty.encode("ascii")[:8])
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(header)
+            f.write(rec.tobytes())
+        os.replace(tmp, path)   # 途中で落ちても壊れたファイルを残さない
+        return True
+    except Exception:
+        try:
+            os.remove(tmp)
+        except Exception:
+            pass
+        return False
+
+
+def _read_cache(path, digest=None, difficulty=None, seed=None):
+    chart = load_chart_file(path, digest, difficulty, seed)
+    if chart is not None:
+        try:
+            os.utime(path, None)   # LRU 用に最終利用時刻を更新
+        except OSError:
+            pass
+    return chart
+
+
+def chart_cache_size(cache_dir=None):
+    """キャッシュの合計バイト数"""
+    total = 0
+    try:
+        with os.scandir(cache_dir or CACHE_DIR) as it:
+            for e in it:
+                if e.is_file() and e.name.endswith(_CACHE_EXT):
+                    total += e.stat().st_size
+    except OSError:
+        pass
+    return total
+
+
+def evict_chart_cache(cache_dir=None, max_bytes=None):
+    """合計サイズが上限を超えていたら、最終利用が古い順に消す。"""
+    cache_dir = cache_dir or CACHE_DIR
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    try:
+        entries = []
+        with os.scandir(cache_dir) as it:
+            for e in it:
+                if e.is_file() and e.name.endswith(_CACHE_EXT):
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def load_or_compile_chart(midi_path, difficulty="Normal", lanes=LANES, cache_dir=None, song=None,
+                          seed=None):
+    """
+    Chart を返す。キャッシュにあれば読むだけ、無ければ生成→保存。
+    song（MidiSong）を渡すと、キャッシュミス時の再解析を避けられる。
+    seed を省略すると曲と難易度から決まる値を使う。
+    """
+    try:
+        digest = file_digest(midi_path)
+    except OSError:
+        digest = None
+    if seed is None:
+        seed = chart_seed(digest or os.path.abspath(midi_path), difficulty)
+    key = chart_cache_key(digest, difficulty, seed) if digest else None
+    if key:
+        hit = _read_cache(_cache_path(key, cache_dir), digest, difficulty, seed)
+        if hit is not None:
+            return hit
+
+    if song is None:
+        song = load_song(midi_path)
+    chart = compile_song_chart(song, difficulty, lanes, seed)
+    if key:
+        save_chart_file(_cache_path(key, cache_dir), chart, digest, difficulty, seed)
+        evict_chart_cache(cache_dir)
+    return chart
+
+
+# ====== 一括生成（配布時にキャッシュを温めておく） ======
+def precompile_song(midi_path, difficulties=DIFFICULTIES, lanes=LANES, cache_dir=None):
+    """
+    1曲ぶん、各難易度の譜面をキャッシュへ書く（ワーカープロセスで実行。Qt は読み込まない）。
+    (midi_path, {難易度: "cached" / "compiled"}, エラー文字列 or None) を返し、例外は出さない。
+    キャッシュのキーと内容は load_or_compile_chart（既定のシード）と同じ。
+    """
+    status = {}
+    try:
+        digest = file_digest(midi_path)
+        song = None
+        for diff in difficulties:
+            seed = chart_seed(digest, diff)
+            path = _cache_path(chart_cache_key(digest, diff, seed), cache_dir)
+            if load_chart_file(path, digest, diff, seed) is not None:
+                status[diff] = "cached"
+                continue
+            if song is None:
+                song = MidiSong(midi_path)
+            if not save_chart_file(path, compile_song_chart(song, diff, lanes, seed), digest, diff, seed):
+                raise OSError(f"cannot write {path}")
+            status[diff] = "compiled"
+        return midi_path, status, None
+    except Exception as ex:
+        return midi_path, status, f"{type(ex).__name__}: {ex}"
+
+
+def find_midi_files(roots, errors=None):
+    """
+    roots 配下（再帰）の MIDI ファイル。ファイルを直接渡してもよい。
+    無い・読めない root は errors（リスト）に (root, メッセージ) を足す。
+    """
+    from song_library import scan_dir, MIDI_EXTS
+    out = []
+    for root in roots:
+        if os.path.isfile(root):
+            if root.lower().endswith(MIDI_EXTS):
+                out.append(root)
+            elif errors is not None:
+                errors.append((root, "not a MIDI file"))
+            continue
+        if not os.path.isdir(root):
+            if errors is not None:
+                errors.append((root, "no such file or folder"))
+            continue
+        stack = [root]
+        while stack:
+            d = stack.pop()
+            res = scan_dir(d)
+            if res is None:
+                if d == root and errors is not None:
+                    errors.append((root, "cannot read folder"))
+                continue
+            files, subdirs, _ = res
+            out.extend(sorted(files))
+            stack.extend(sorted(subdirs, reverse=True))
+    return list(dict.fromkeys(out))
+
+
+def precompile_charts(paths, difficulties=DIFFICULTIES, lanes=LANES, cache_dir=None, workers=None,
+                      on_result=None):
+    """
+    paths の全曲×難易度をプロセスプールで生成してキャッシュへ書く。
+    1曲終わるたびに on_result(done, total, (path, status, error)) を呼ぶ。1曲の失敗は他に影響しない。
+    戻り値は結果のリスト。キャッシュの追い出しはしない（容量の判断は呼び出し側で）。
+    """
+    paths = list(paths)
+    results = []
+    if not paths:
+        return results
+    workers = workers or max(1, min(len(paths), (os.cpu_count() or 2) - 1))
+    # spawn：親の状態を引き継がない。ワーカーが読むのはこのモジュールと midi_song だけ
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        futures = {pool.submit(precompile_song, p, tuple(difficulties), lanes, cache_dir): p for p in paths}
+        for fut in as_completed(futures):
+            try:
+                res = fut.result()
+            except Exception as ex:          # ワーカーごと落ちた（BrokenProcessPool など）
+                res = (futures[fut], {}, f"{type(ex).__name__}: {ex}")
+            results.append(res)
+            if on_result:
+                on_result(len(results), len(paths), res)
+    return results
+
+
+def precompile_main(argv=None):
+    """コマンドライン：python midi_chart.py ROOT [ROOT ...]"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Compile charts for every song x difficulty under the given music roots into the chart cache.")
+    parser.add_argument("roots", nargs="+", help="Music folders (searched recursively) or MIDI files.")
+    parser.add_argument("--difficulty", choices=DIFFICULTIES, action="append",
+                        help="Difficulty to compile (repeatable; default: all).")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count - 1).")
+    parser.add_argument("--cache-dir", default=None,
+                        help="Chart cache folder (default: $BREAKGATE_CHART_CACHE or ~/.breakgate/chart_cache).")
+    parser.add_argument("--quiet", action="store_true", help="Only print errors and the summary.")
+    args = parser.parse_args(argv)
+
+    difficulties = tuple(args.difficulty or DIFFICULTIES)
+    root_errors = []
+    paths = find_midi_files(args.roots, root_errors)
+    for root, error in root_errors:
+        print(f"ERROR {root}: {error}", file=sys.stderr)
+    print(f"{len(paths)} songs x {len(difficulties)} difficulties -> {args.cache_dir or CACHE_DIR}")
+    counts = {"compiled": 0, "cached": 0}
+    errors = []
+    t0 = time.perf_counter()
+
+    def report(done, total, res):
+        path, status, error = res
+        for v in status.values():
+            counts[v] += 1
+        if error:
+            errors.append((path, error))
+            print(f"[{done}/{total}] ERROR {path}: {error}", file=sys.stderr)
+        elif not args.quiet:
+            detail = " ".join(f"{d}:{status.get(d, '-')}" for d in difficulties)
+            print(f"[{done}/{total}] {detail}  {path}")
+
+    precompile_charts(paths, difficulties, cache_dir=args.cache_dir, workers=args.workers, on_result=report)
+    size = chart_cache_size(args.cache_dir)
+    print(f"compiled {counts['compiled']}, already cached {counts['cached']}, failed {len(errors)} songs "
+          f"in {time.perf_counter() - t0:.1f}s; cache {size / 1048576:.1f} MB")
+    if root_errors:
+        print(f"{len(root_errors)} of the given roots could not be read", file=sys.stderr)
+    if size > CACHE_MAX_BYTES:
+        print(f"warning: cache is larger than the limit ({CACHE_MAX_BYTES / 1048576:.0f} MB); "
+              f"older charts will be evicted at play time. Set BREAKGATE_CHART_CACHE_MB to keep them all.",
+              file=sys.stderr)
+    return 1 if errors or root_errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(precompile_main())
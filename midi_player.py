@@ -0,0 +1,453 @@
+# midi_player.py
+# MidiSong の再生エンジン（絶対時刻スケジューリング）
+import time
+import threading
+import multiprocessing
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+# PortMidi に渡す先読み幅（ms）。OS のスリープ誤差より十分大きくしておく。
+# Output は同じ latency で開くこと（0 だとタイムスタンプが無視される）。
+OUTPUT_LATENCY_MS = 50
+
+_MAX_BATCH = 1024     # Output.write の1回あたり上限
+_SPIN_SEC = 0.002     # タイムスタンプ無し出力のとき、最後はこの幅だけ空回しで待つ
+
+
+class _JitterStats:
+    """送出タイミングの実測値（直近ぶんだけ保持）"""
+    def __init__(self, keep=4096):
+        self.wake_ms = deque(maxlen=keep)   # 予定の送出時刻からの遅れ
+        self.events = 0
+        self.late = 0                        # 鳴らしたい時刻を過ぎてから送った数
+        self.max_late_ms = 0.0
+
+    def record(self, wake_ms, late_ms, count):
+        self.wake_ms.append(wake_ms)
+        self.events += count
+        if late_ms > 1.0:
+            self.late += count
+            self.max_late_ms = max(self.max_late_ms, late_ms)
+
+    def summary(self):
+        w = sorted(self.wake_ms)
+        if not w:
+            return {"events": self.events, "late": self.late, "max_late_ms": self.max_late_ms,
+                    "wake_mean_ms": 0.0, "wake_p99_ms": 0.0, "wake_max_ms": 0.0}
+        return {
+            "events": self.events,
+            "late": self.late,
+            "max_late_ms": self.max_late_ms,
+            "wake_mean_ms": sum(w) / len(w),
+            "wake_p99_ms": w[min(len(w) - 1, int(len(w) * 0.99))],
+            "wake_max_ms": w[-1],
+        }
+
+
+class MidiPlayer:
+    """
+    MidiSong（の EventBuffer）を「曲頭からの絶対時刻」で送出する。
+      ・各イベントの締め切りは origin + t（clock 基準）。相対スリープを積み上げないのでズレが溜まらない
+      ・latency_ms > 0 なら PortMidi のタイムスタンプ付き write で、細かいタイミングはドライバ任せ
+      ・start / pause / resume / seek / stop に対応
+    clock はゲーム側と同じもの（既定は time.perf_counter）を渡すこと。
+    """
+    def __init__(self, song, midi_out=None, latency_ms=OUTPUT_LATENCY_MS, clock=time.perf_counter):
+        self.song = song
+        self.midi_out = midi_out
+        self.latency = max(0, latency_ms) / 1000.0
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._paused = False
+        self._origin = 0.0    # 曲の 0 秒が鳴る clock 時刻
+        self._pos = 0.0       # 一時停止中の再生位置
+        self._cursor = 0      # 次に送るイベント
+        self._stats = _JitterStats()
+
+    # ====== 操作 ======
+    def start(self, at=None, offset=0.0):
+        """clock 時刻 at に、曲の offset 秒の位置が鳴るように再生を始める。"""
+        if at is None:
+            at = self.clock()
+        with self._cond:
+            self._origin = at - offset
+            self._cursor = bisect_left(self.song.buffer.time_list, offset)
+            self._running = True
+            self._paused = False
+            cursor = self._cursor
+            self._cond.notify_all()
+        self._chase(cursor)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def position(self):
+        """現在の再生位置（曲頭からの秒）"""
+        with self._cond:
+            return self._pos if self._paused else self.clock() - self._origin
+
+    def pause(self):
+        with self._cond:
+            if not self._running or self._paused:
+                return
+            self._pos = self.clock() - self._origin
+            self._paused = True
+            self._cond.notify_all()
+        self._all_notes_off()
+
+    def resume(self, at=None):
+        with self._cond:
+            if not self._paused:
+                return
+            self._origin = (self.clock() if at is None else at) - self._pos
+            self._paused = False
+            self._cond.notify_all()
+
+    def seek(self, seconds, at=None):
+        seconds = max(0.0, float(seconds))
+        with self._cond:
+            if self._paused:
+                self._pos = seconds
+            else:
+                self._origin = (self.clock() if at is None else at) - seconds
+            self._cursor = bisect_left(self.song.buffer.time_list, seconds)
+            cursor = self._cursor
+            self._cond.notify_all()
+        self._all_notes_off()
+        self._chase(cursor)
+
+    def stop(self, timeout=1.0):
+        with self._cond:
+            was_running = self._running
+            self._running = False
+            self._cond.notify_all()
+        th = self._thread
+        if th is not None and th is not threading.current_thread():
+            th.join(timeout)
+        if was_running:
+            self._all_notes_off()
+
+    def is_playing(self):
+        with self._cond:
+            return self._running and not self._paused
+
+    def jitter_stats(self):
+        """送出タイミングの統計（ms）。wake_* は予定の送出時刻からの遅れ。"""
+        with self._cond:
+            return self._stats.summary()
+
+    # ====== 送出ループ ======
+    def _run(self):
+        # 読み込み時に変換済みの配列を引くだけ（メッセージの解釈はしない）
+        times = self.song.buffer.time_list
+        data = self.song.buffer.byte_list
+        n = len(times)
+        while True:
+            with self._cond:
+                while self._running and self._paused:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                i = self._cursor
+                if i >= n:
+                    self._running = False
+                    return
+                # タイムスタンプ付きなら latency ぶん早めに渡してよい
+                origin = self._origin
+                issue_at = origin + times[i] - self.latency
+                now = self.clock()
+                remain = issue_at - now
+                if remain > _SPIN_SEC:
+                    # 途中で seek/pause/stop されたら起こされる → ループ先頭からやり直し
+                    self._cond.wait(remain - _SPIN_SEC)
+                    continue
+                if remain <= 0 or self.latency > 0:
+                    # 送出時刻に達したものをまとめて取り出す
+                    limit = max(now, issue_at) + self.latency
+                    j = i
+                    while j < n and j - i < _MAX_BATCH and origin + times[j] <= limit:
+                        j += 1
+                    self._cursor = j
+                    self._stats.record(max(0.0, now - issue_at) * 1000.0,
+                                       (now - (origin + times[i])) * 1000.0, j - i)
+            if remain > 0 and self.latency <= 0:
+                # タイムスタンプが使えないときは最後の数 ms を空回しで詰める
+                while self.clock() < issue_at:
+                    time.sleep(0)
+                continue
+            self._send(data, times, i, j, origin)
+
+    def _send(self, data, times, i, j, origin):
+        out = self.midi_out
+        if out is None:
+            return
+        try:
+            if self.latency > 0:
+                from midi_utils import midi_time
+                # clock 時刻 → PortMidi 時刻（ms）。PortMidi は ts + latency で鳴らす
+                pm_now = midi_time()
+                base = pm_now - self.clock() * 1000.0 - self.latency * 1000.0 + origin * 1000.0
+                out.write([[data[k], int(base + times[k] * 1000.0)] for k in range(i, j)])
+            else:
+                for k in range(i, j):
+                    out.write_short(*data[k])
+        except Exception:
+            pass
+
+    def _chase(self, cursor):
+        """途中から鳴らすとき、それまでの音色・コントロールの状態だけ先に送る。"""
+        out = self.midi_out
+        if out is None or cursor <= 0:
+            return
+        try:
+            for data in self.song.buffer.chase(cursor):
+                out.write_short(*data)
+        except Exception:
+            pass
+
+    def _all_notes_off(self):
+        out = self.midi_out
+        if out is None:
+            return
+        try:
+            for ch in range(16):
+                out.write_short(0xB0 | ch, 123, 0)   # All Notes Off
+        except Exception:
+            pass
+
+
+# ====== 別プロセス再生 ======
+# GUI スレッドが GIL を長く握っても音の送出が遅れないよう、スケジューラごと子プロセスで動かす。
+# 子プロセスで使うのはこのモジュールと midi_utils だけ。ただし spawn なので、親の __main__（main.py なら
+# PyQt ごと）も読み直される。QApplication は作らないが、起動に少し時間がかかるので wait_ready で待つこと。
+_PROCESS_START_TIMEOUT = 5.0
+
+
+class _RawSong:
+    """子プロセス側で使う、EventBuffer と同じ形の最小限の曲"""
+    class _Buffer:
+        def __init__(self, time_list, byte_list):
+            self.time_list = time_list
+            self.byte_list = byte_list
+
+        def chase(self, index):
+            # EventBuffer.chase と同じ内容（子プロセスでは NumPy を使わない）
+            last = {}
+            for k, (st, d1, _) in enumerate(self.byte_list[:index]):
+                kind = st & 0xF0
+                if kind == 0xB0:
+                    last[(st, d1)] = k
+                elif kind in (0xC0, 0xD0, 0xE0):
+                    last[(st, 0)] = k
+            return [self.byte_list[k] for k in sorted(last.values())]
+
+    def __init__(self, times_bytes, data_bytes):
+        times = array("d")
+        times.frombytes(times_bytes)
+        data = list(data_bytes)
+        self.buffer = self._Buffer(times.tolist(), [data[k:k + 3] for k in range(0, len(data), 3)])
+
+
+def _playback_process_main(conn, times_bytes, data_bytes, device_id, latency_ms):
+    """子プロセス本体：パイプからコマンドを受けて MidiPlayer を操作する。"""
+    from midi_utils import midi_broker, resolve_output_id
+    out = None
+    try:
+        device_id = resolve_output_id(device_id)
+        if device_id == -1:
+            raise OSError("no MIDI output device")
+        out = midi_broker().acquire(device_id)
+    except Exception as ex:
+        conn.send(("error", f"{type(ex).__name__}: {ex}"))   # 開けなくても動かしておく（無音）
+    player = MidiPlayer(_RawSong(times_bytes, data_bytes), out, latency_ms=latency_ms,
+                        clock=time.perf_counter)
+    conn.send(("ready", out.name if out is not None else None))
+    try:
+        while True:
+            try:
+                cmd = conn.recv()
+            except (EOFError, OSError):
+                break        # 親が落ちた
+            op = cmd[0]
+            if op == "start":
+                player.start(at=cmd[1], offset=cmd[2])
+            elif op == "pause":
+                player.pause()
+            elif op == "resume":
+                player.resume(at=cmd[1])
+            elif op == "seek":
+                player.seek(cmd[1], at=cmd[2])
+            elif op == "stop":
+                player.stop()
+            elif op == "stats":
+                conn.send(("stats", player.jitter_stats()))
+            elif op == "clock":
+                conn.send(("clock", time.perf_counter()))
+            elif op == "quit":
+                break
+    finally:
+        player.stop()
+        if out is not None:
+            out.close()
+
+
+class ProcessMidiPlayer:
+    """
+    MidiPlayer と同じ操作を、別プロセスの再生スケジューラに対して行う。
+      ・曲は EventBuffer のバイト列として1回だけ渡す
+      ・start / pause / resume / seek / stop はパイプで送る（時刻は clock 基準の絶対値で渡すので、
+        親と子は同じ 0 秒の時刻で動く。親の位置は自分で計算し、子に問い合わせない）
+    clock は perf_counter 基準であること。perf_counter がプロセス間で同じ基準かは起動時に
+    パイプの往復で確かめ、違っていれば差を足して子の時計に直して送る。
+    出力デバイスは子プロセスが device_id で開く（親のブローカーが開いたままなら先に閉じる）。
+    開けなかったときは error にメッセージが入る（再生は無音のまま進む）。
+    """
+    def __init__(self, song, device_id, latency_ms=OUTPUT_LATENCY_MS, clock=time.perf_counter):
+        self.clock = clock
+        self.latency = max(0, latency_ms) / 1000.0
+        self.device_name = None
+        self.error = None
+        self._clock_offset = 0.0   # 子の perf_counter − 親の clock
+        if device_id is not None and device_id >= 0:
+            # 1つしか開けないドライバがあるので、親で開いたままの（使っていない）出力は閉じておく
+            from midi_utils import midi_broker
+            if not midi_broker().close_idle(device_id):
+                self.error = f"MIDI output {device_id} is in use in this process"
+        ctx = multiprocessing.get_context("spawn")   # Qt のスレッドを抱えたまま fork しない
+        self._conn, child = ctx.Pipe()
+        self._lock = threading.Lock()
+        self._running = False
+        self._paused = False
+        self._origin = 0.0    # 曲の 0 秒が鳴る clock 時刻（子にも同じ値を送る）
+        self._pos = 0.0
+        self._length = song.buffer.time_list[-1] if len(song.buffer) else 0.0
+        self._proc = ctx.Process(
+            target=_playback_process_main, name="midi-playback", daemon=True,
+            args=(child, song.buffer.times.tobytes(), song.buffer.data.tobytes(),
+                  device_id, latency_ms))
+        self._proc.start()
+        child.close()
+        self._ready = False
+
+    def _send(self, *cmd):
+        try:
+            self._conn.send(cmd)
+        except (OSError, ValueError):
+            pass
+
+    def wait_ready(self, timeout=_PROCESS_START_TIMEOUT):
+        """子プロセスが出力を開き終えるまで待ち、時計の基準を合わせる。出力を開けていれば True。"""
+        if not self._ready:
+            deadline = time.perf_counter() + timeout
+            try:
+                while self._conn.poll(max(0.0, deadline - time.perf_counter())):
+                    msg = self._conn.recv()
+                    if msg[0] == "error":
+                        self.error = msg[1]
+                    elif msg[0] == "ready":
+                        self.device_name = msg[1]
+                        self._ready = True
+                        self._sync_clock(max(0.0, deadline - time.perf_counter()))
+                        break
+            except (EOFError, OSError):
+                pass
+            if not self._ready and self.error is None:
+                self.error = "playback process did not start"
+        return self._ready and self.device_name is not None
+
+    def _sync_clock(self, timeout):
+        """子の perf_counter を1往復で読み、親の clock の送受信の間に入っていなければ差を覚える"""
+        t0 = self.clock()
+        self._send("clock")
+        try:
+            if self._conn.poll(timeout):
+                msg = self._conn.recv()
+                t1 = self.clock()
+                if msg[0] == "clock" and not (t0 <= msg[1] <= t1):
+                    self._clock_offset = msg[1] - (t0 + t1) / 2.0
+        except (EOFError, OSError):
+            pass
+
+    # ====== 操作（MidiPlayer と同じ） ======
+    def start(self, at=None, offset=0.0):
+        if at is None:
+            at = self.clock()
+        with self._lock:
+            self._origin = at - offset
+            self._running = True
+            self._paused = False
+        self._send("start", at + self._clock_offset, offset)
+
+    def position(self):
+        with self._lock:
+            return self._pos if self._paused else self.clock() - self._origin
+
+    def pause(self):
+        with self._lock:
+            if not self._running or self._paused:
+                return
+            self._pos = self.clock() - self._origin
+            self._paused = True
+        self._send("pause")
+
+    def resume(self, at=None):
+        with self._lock:
+            if not self._paused:
+                return
+            if at is None:
+                at = self.clock()
+            self._origin = at - self._pos
+            self._paused = False
+        self._send("resume", at + self._clock_offset)
+
+    def seek(self, seconds, at=None):
+        seconds = max(0.0, float(seconds))
+        with self._lock:
+            if at is None:
+                at = self.clock()
+            if self._paused:
+                self._pos = seconds
+            else:
+                self._origin = at - seconds
+        self._send("seek", seconds, at + self._clock_offset)
+
+    def stop(self, timeout=1.0):
+        with self._lock:
+            self._running = False
+        self._send("stop")
+        self._send("quit")
+        proc = self._proc
+        if proc is not None:
+            proc.join(timeout)
+            if proc.is_alive():
+                proc.terminate()
+            self._proc = None
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+
+    def is_playing(self):
+        with self._lock:
+            if not self._running or self._paused:
+                return False
+            return self.clock() - self._origin <= self._length + self.latency
+
+    def jitter_stats(self, timeout=0.5):
+        self._send("stats")
+        try:
+            while self._conn.poll(timeout):
+                msg = self._conn.recv()
+                if msg[0] == "ready":
+                    self.device_name = msg[1]
+                    self._ready = True
+                elif msg[0] == "error":
+                    self.error = msg[1]
+                elif msg[0] == "stats":
+                    return msg[1]
+        except (EOFError, OSError):
+            pass
+        return _JitterStats().summary()
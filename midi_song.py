@@ -0,0 +1,193 @@
+# midi_song.py
+# MIDI を一度だけ読み込んで、譜面生成・再生・試聴で共有する
+import os
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+import mido
+import numpy as np
+
+
+DEFAULT_TEMPO = 500000   # μs / 拍（120 BPM）
+
+
+class TempoMap:
+    """
+    テンポ区間の索引。区間 k は tick[k] から始まり、その時点の秒 sec[k] と テンポ tempo[k]（μs/拍）を持つ。
+    tick ↔ 秒 の変換は区間を二分探索して1次式で計算する（ファイルを頭から辿り直さない）。
+    """
+    def __init__(self, ticks_per_beat, changes=()):
+        """changes: (絶対tick, テンポ) の列（tick 昇順）"""
+        self.ticks_per_beat = ticks_per_beat
+        ticks, tempos = [0], [DEFAULT_TEMPO]
+        for tick, tempo in changes:
+            if tick == ticks[-1]:
+                tempos[-1] = tempo      # 同じ tick の変更は後勝ち
+            else:
+                ticks.append(tick)
+                tempos.append(tempo)
+        secs = [0.0]
+        for k in range(1, len(ticks)):
+            secs.append(secs[-1] + (ticks[k] - ticks[k - 1]) * tempos[k - 1] / (1e6 * ticks_per_beat))
+        self.tick = ticks
+        self.sec = secs
+        self.tempo = tempos
+        self._tick_arr = np.array(ticks, dtype=np.int64)
+        self._sec_arr = np.array(secs, dtype=np.float64)
+        self._scale_arr = np.array(tempos, dtype=np.float64) / (1e6 * ticks_per_beat)   # 秒 / tick
+
+    def __len__(self):
+        return len(self.tick)
+
+    def tick_to_seconds(self, tick):
+        k = bisect_right(self.tick, tick) - 1
+        k = max(k, 0)
+        return self.sec[k] + (tick - self.tick[k]) * self.tempo[k] / (1e6 * self.ticks_per_beat)
+
+    def seconds_to_tick(self, seconds):
+        k = max(bisect_right(self.sec, seconds) - 1, 0)
+        return self.tick[k] + (seconds - self.sec[k]) * 1e6 * self.ticks_per_beat / self.tempo[k]
+
+    def ticks_to_seconds(self, ticks):
+        """tick 配列 → 秒配列（まとめて変換）"""
+        ticks = np.asarray(ticks, dtype=np.int64)
+        k = np.maximum(np.searchsorted(self._tick_arr, ticks, side="right") - 1, 0)
+        return self._sec_arr[k] + (ticks - self._tick_arr[k]) * self._scale_arr[k]
+
+    def tempo_at(self, seconds):
+        """その時点のテンポ（μs/拍）"""
+        return self.tempo[max(bisect_right(self.sec, seconds) - 1, 0)]
+
+
+class EventBuffer:
+    """
+    再生用に読み込み時点でバイト列へ落としたチャンネルメッセージ（全チャンネル・CC・プログラムチェンジなど）。
+      times : 絶対時刻（秒, float64, 昇順）
+      data  : (n, 3) uint8。ステータス（チャンネル込み）, data1, data2（2バイトのメッセージは data2=0）
+      ticks : 元の MIDI での絶対 tick（int64。無ければ None）
+    再生スレッドは time_list / byte_list（同じ内容の Python リスト）を添字で引いて書くだけ。
+    """
+    def __init__(self, times, data, ticks=None):
+        self.times = np.ascontiguousarray(times, dtype=np.float64)
+        self.data = np.ascontiguousarray(data, dtype=np.uint8).reshape(-1, 3)
+        self.ticks = None if ticks is None else np.ascontiguousarray(ticks, dtype=np.int64)
+        self.time_list = self.times.tolist()
+        self.byte_list = self.data.tolist()
+
+    @classmethod
+    def from_messages(cls, times, messages, ticks=None):
+        keep = []
+        raw = []
+        for k, msg in enumerate(messages):
+            if msg.is_meta:
+                continue
+            b = msg.bytes()
+            if not b or b[0] >= 0xF0:
+                continue   # SysEx・システムメッセージは送らない
+            keep.append(k)
+            raw.append((b + [0, 0])[:3])
+        keep = np.array(keep, dtype=np.int64)
+        return cls(np.asarray(times, dtype=np.float64)[keep] if len(keep) else np.zeros(0),
+                   np.array(raw, dtype=np.uint8).reshape(-1, 3),
+                   None if ticks is None else np.asarray(ticks, dtype=np.int64)[keep])
+
+    def __len__(self):
+        return len(self.times)
+
+    def note_on_mask(self):
+        """発音（velocity>0 の note_on）の位置"""
+        return ((self.data[:, 0] & 0xF0) == 0x90) & (self.data[:, 2] > 0)
+
+    def chase(self, index):
+        """
+        index より前のイベントを送らずに途中から鳴らすとき、先に送っておく状態
+        （チャンネルごとの最後のプログラムチェンジ・コントロールチェンジ・ピッチベンド・チャンネルプレッシャー）。
+        戻り値は [status, data1, data2] のリスト（元の順序）。
+        """
+        head = self.data[:index]
+        kind = head[:, 0] & 0xF0
+        is_cc = kind == 0xB0
+        keep = is_cc | (kind == 0xC0) | (kind == 0xD0) | (kind == 0xE0)
+        pos = np.flatnonzero(keep)
+        if len(pos) == 0:
+            return []
+        # 同じ (status, CC番号) の最後の1つだけ残す
+        key = head[pos, 0].astype(np.int32) << 8
+        key = key | np.where(is_cc[pos], head[pos, 1], 0)
+        _, last = np.unique(key[::-1], return_index=True)
+        sel = np.sort(pos[len(pos) - 1 - last])
+        return self.data[sel].tolist()
+
+
+class MidiSong:
+    """
+    1曲ぶんの MIDI。全トラックをマージした「絶対時刻（秒）」のタイムラインを持つ。
+    mido.MidiFile 自体は保持しない（読み込み後は捨てる）。
+    """
+    def __init__(self, path, midi=None):
+        self.path = path
+        midi = midi if midi is not None else mido.MidiFile(path)
+        self.ticks_per_beat = midi.ticks_per_beat
+        # 全トラックを tick のままマージし、テンポ区間の索引で一括して秒へ直す
+        self.messages = []   # 各イベントのメッセージ（時刻順）
+        ticks = []
+        changes = []
+        tick = 0
+        for msg in mido.merge_tracks(midi.tracks, skip_checks=True):   # 検査とコピーを省く（MidiFile.__iter__ と同じ）
+            tick += msg.time
+            ticks.append(tick)
+            self.messages.append(msg)
+            if msg.type == "set_tempo":
+                changes.append((tick, msg.tempo))
+        self.tempo_map = TempoMap(self.ticks_per_beat, changes)
+        self.ticks = np.array(ticks, dtype=np.int64)                     # 絶対 tick
+        self.times = self.tempo_map.ticks_to_seconds(self.ticks).tolist()  # 絶対時刻（秒・昇順）
+        self.length = self.times[-1] if self.times else 0.0
+        self.buffer = EventBuffer.from_messages(self.times, self.messages, self.ticks)
+
+    def __len__(self):
+        return len(self.messages)
+
+    def note_on_times(self):
+        """発音（velocity>0 の note_on）の時刻（float64 配列）"""
+        return self.buffer.times[self.buffer.note_on_mask()]
+
+    def note_on_ticks(self):
+        """発音の絶対 tick（int64 配列。note_on_times と同じ並び）"""
+        return self.buffer.ticks[self.buffer.note_on_mask()]
+
+    def events(self, until=None):
+        """(絶対秒, msg) を順に返す。until を指定するとその秒まで。"""
+        for t, msg in zip(self.times, self.messages):
+            if until is not None and t > until:
+                break
+            yield t, msg
+
+
+# ====== 読み込みキャッシュ（試聴→本番で同じ曲を再解析しない） ======
+_SONG_CACHE_MAX = 4
+_song_cache = OrderedDict()
+_song_cache_lock = threading.Lock()
+
+
+def _file_sig(path):
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+
+def load_song(path) -> MidiSong:
+    """MidiSong を返す。同じファイル（パス＋更新時刻＋サイズ）なら使い回す。"""
+    sig = _file_sig(path)
+    with _song_cache_lock:
+        song = _song_cache.get(sig)
+        if song is not None:
+            _song_cache.move_to_end(sig)
+            return song
+    song = MidiSong(path)
+    with _song_cache_lock:
+        _song_cache[sig] = song
+        _song_cache.move_to_end(sig)
+        while len(_song_cache) > _SONG_CACHE_MAX:
+            _song_cache.popitem(last=False)
+    return song
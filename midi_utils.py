@@ -1,25 +1,48 @@
 # midi_utils.py
 import time
+import queue
+import atexit
+import threading
 import pygame.midi
 
+from midi_player import OUTPUT_LATENCY_MS
+
+# PortMidi はスレッドセーフではないので、pygame.midi の呼び出しはすべてこのロックの中で行う
+_pm_lock = threading.RLock()
+
+
 def _safe_midi_init():
-    # pygame.midi.init() は複数回呼んでもOKだが軽くガード
-    if not pygame.midi.get_init():
-        pygame.midi.init()
+    # PortMidi はプロセスの間ずっと初期化したままにする（quit はブローカーの shutdown だけ）
+    with _pm_lock:
+        if not pygame.midi.get_init():
+            pygame.midi.init()
 
-def list_midi_output_devices():
+
+def midi_time():
+    """PortMidi の時計（ms）。タイムスタンプ付き送出の基準。"""
+    _safe_midi_init()
+    return pygame.midi.time()
+
+
+def _enumerate_outputs():
+    """PortMidi に出力デバイスを問い合わせる（遅い環境があるので通常はキャッシュ経由で）"""
     _safe_midi_init()
-    n = pygame.midi.get_count()
     devices = []
-    for i in range(n):
-        info = pygame.midi.get_device_info(i)
-        if not info:
-            continue
-        interf, name, is_input, is_output, opened = info
-        if is_output:
-            devices.append((i, name.decode(errors="ignore")))
+    with _pm_lock:
+        n = pygame.midi.get_count()
+        for i in range(n):
+            info = pygame.midi.get_device_info(i)
+            if not info:
+                continue
+            interf, name, is_input, is_output, opened = info
+            if is_output:
+                devices.append((i, name.decode(errors="ignore")))
     return devices
 
+def list_midi_output_devices():
+    """[(id, 名前), ...]。バックグラウンドで取得済みのキャッシュを返す。"""
+    return midi_device_cache().devices()
+
 def pick_default_midi_out_id(prefer_names=("Microsoft GS Wavetable", "MIDI", "Synth")) -> int:
     """候補名を優先して出力デバイスIDを選ぶ。無ければ先頭。無ければ -1。"""
     outs = list_midi_output_devices()
@@ -30,16 +53,333 @@ def pick_default_midi_out_id(prefer_names=("Microsoft GS Wavetable", "MIDI", "Sy
             return pid
     return outs[0][0]
 
+def resolve_output_id(device_id: int = None) -> int:
+    """device_id=None / -1 なら pick→pygame のデフォルトの順で選んだ ID。無ければ -1。"""
+    if device_id is None or device_id == -1:
+        device_id = pick_default_midi_out_id()
+        if device_id == -1:
+            _safe_midi_init()
+            with _pm_lock:
+                device_id = pygame.midi.get_default_output_id()
+    return -1 if device_id is None else device_id
+
+def output_device_name(device_id):
+    return dict(list_midi_output_devices()).get(device_id)
+
 def open_output_or_none(device_id: int = None):
-    """Output を開いて返す（失敗時 None）。device_id=None なら pick→デフォルトの順で選ぶ。"""
+    """
+    出力ハンドルを返す（失敗時 None）。device_id=None なら pick→デフォルトの順で選ぶ。
+    実体はブローカーが共有しているので、使い終わったら必ず close() すること。
+    """
     try:
-        _safe_midi_init()
-        if device_id is None or device_id == -1:
-            device_id = pick_default_midi_out_id()
-            if device_id == -1:
-                device_id = pygame.midi.get_default_output_id()
-        if device_id is None or device_id == -1:
+        device_id = resolve_output_id(device_id)
+        if device_id == -1:
             return None
-        return pygame.midi.Output(device_id)
+        return midi_broker().acquire(device_id)
     except Exception:
         return None
+
+
+# ====== 出力デバイスのブローカー ======
+class MidiOutputHandle:
+    """
+    ブローカーが貸し出す出力。pygame.midi.Output と同じ write_short / write / close を持つ。
+    送出は1本の送信スレッドにキューで渡すので、どのスレッドから呼んでもよい。
+    デバイスは latency_ms（タイムスタンプ付き）で開かれている。
+    """
+    def __init__(self, broker, entry):
+        self._broker = broker
+        self._entry = entry
+        self._closed = False
+        self.device_id = entry.device_id
+        self.name = entry.name
+        self.latency_ms = entry.latency_ms
+
+    def write_short(self, status, data1=0, data2=0):
+        if not self._closed:
+            self._broker._put(self._entry, "short", (status, data1, data2))
+
+    def write(self, data):
+        if not self._closed and data:
+            self._broker._put(self._entry, "write", data)
+
+    def all_notes_off(self):
+        if not self._closed:
+            self._broker._put(self._entry, "write", _ALL_NOTES_OFF)
+
+    def close(self):
+        if self._closed:
+            return
+        self.all_notes_off()
+        self._closed = True
+        self._broker._release(self._entry)
+
+
+# 全チャンネルに All Sound Off(120) / All Notes Off(123)。タイムスタンプ 0 = 即時
+_ALL_NOTES_OFF = [[[0xB0 | ch, cc, 0], 0] for ch in range(16) for cc in (120, 123)]
+
+
+class _OutputEntry:
+    def __init__(self, device_id, name, output, latency_ms):
+        self.device_id = device_id
+        self.name = name
+        self.output = output
+        self.latency_ms = latency_ms
+        self.refs = 0
+
+
+class MidiDeviceBroker:
+    """
+    PortMidi の初期化と出力デバイスをプロセス内で一元管理する。
+      ・デバイスは最初の acquire で開き、参照が無くなっても開いたままにする（次の休憩では開き直さない）
+      ・送出は送信スレッド1本がキューから順に書く（複数スレッドから同じ Output に触らない）
+      ・ハンドルを返すときは All Notes Off を送る
+    """
+    def __init__(self, latency_ms=OUTPUT_LATENCY_MS):
+        self.latency_ms = latency_ms
+        self._lock = threading.Lock()
+        self._entries = {}            # device_id -> _OutputEntry
+        self._queue = queue.Queue()
+        self._writer = None
+
+    def acquire(self, device_id):
+        """device_id の出力ハンドルを返す（開けなければ例外）。"""
+        _safe_midi_init()
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None:
+                with _pm_lock:
+                    info = pygame.midi.get_device_info(device_id)
+                    out = pygame.midi.Output(device_id, latency=self.latency_ms)
+                name = info[1].decode(errors="ignore") if info else None
+                entry = _OutputEntry(device_id, name, out, self.latency_ms)
+                self._entries[device_id] = entry
+            entry.refs += 1
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run_writer, name="midi-writer", daemon=True)
+                self._writer.start()
+            return MidiOutputHandle(self, entry)
+
+    def rescan(self, timeout=1.0):
+        """
+        貸し出し中のハンドルが無ければ PortMidi を初期化し直す（抜き差ししたデバイスは再初期化しないと見えない）。
+        開いたままのデバイスは送信待ちを書き切ってから閉じる。使用中なら何もせず False。
+        """
+        with self._lock:
+            if any(e.refs for e in self._entries.values()):
+                return False
+            entries = list(self._entries.values())
+            self._entries.clear()
+            writer = self._writer
+            if entries and writer is not None and writer.is_alive():
+                done = threading.Event()
+                for e in entries:
+                    self._put(e, "close", None)
+                self._put(None, "sync", done)
+                done.wait(timeout)
+            else:
+                with _pm_lock:
+                    for e in entries:
+                        try:
+                            e.output.close()
+                        except Exception:
+                            pass
+            with _pm_lock:
+                try:
+                    if pygame.midi.get_init():
+                        pygame.midi.quit()
+                    pygame.midi.init()
+                except Exception:
+                    pass
+        return True
+
+    def close_idle(self, device_id, timeout=1.0):
+        """
+        device_id を貸し出していなければ閉じる（別プロセスに同じデバイスを開かせる前に）。
+        閉じた・開いていなかったなら True、使用中なら False。
+        """
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None:
+                return True
+            if entry.refs:
+                return False
+            del self._entries[device_id]
+            writer = self._writer
+            if writer is not None and writer.is_alive():
+                done = threading.Event()
+                self._put(entry, "close", None)
+                self._put(None, "sync", done)
+                done.wait(timeout)
+            else:
+                with _pm_lock:
+                    try:
+                        entry.output.close()
+                    except Exception:
+                        pass
+        return True
+
+    def active_handles(self):
+        with self._lock:
+            return sum(e.refs for e in self._entries.values())
+
+    def shutdown(self, timeout=1.0):
+        """送信待ちを書き切ってから全デバイスを閉じ、PortMidi を終了する（プロセス終了時）。"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join(timeout)
+        with _pm_lock:
+            for e in entries:
+                try:
+                    e.output.close()
+                except Exception:
+                    pass
+            try:
+                if pygame.midi.get_init():
+                    pygame.midi.quit()
+            except Exception:
+                pass
+
+    # ====== 内部 ======
+    def _put(self, entry, kind, data):
+        self._queue.put((entry, kind, data))
+
+    def _release(self, entry):
+        with self._lock:
+            entry.refs = max(0, entry.refs - 1)
+
+    def _run_writer(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            entry, kind, data = item
+            if kind == "sync":
+                data.set()
+                continue
+            try:
+                with _pm_lock:
+                    if kind == "short":
+                        entry.output.write_short(*data)
+                    elif kind == "write":
+                        entry.output.write(data)
+                    elif kind == "close":
+                        entry.output.close()
+            except Exception:
+                pass
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def midi_broker() -> MidiDeviceBroker:
+    """プロセスで1つのブローカー"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = MidiDeviceBroker()
+            atexit.register(_broker.shutdown)
+        return _broker
+
+
+# ====== 出力デバイス一覧のキャッシュ ======
+class MidiDeviceCache:
+    """
+    出力デバイス一覧をバックグラウンドで取得して保持する。
+      devices()      : キャッシュを返す（取得中なら終わるまで待つ）
+      updated_at     : 最後に取得した時刻（time.time()）
+      refresh_async(): すぐに取り直す（結果は subscribe したコールバックへ）。rescan=True で PortMidi も初期化し直す
+    PortMidi は初期化し直さないと抜き差しを拾わないが、初期化し直すと開いたままの出力も閉じてしまう。
+    なので定期的には取り直さない。新しいデバイスが見えるのは利用者の再検索（refresh_async）のときだけ。
+    コールバックは一覧が変わったときだけ、取得スレッドから callback(devices) で呼ばれる。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._devices = None
+        self._ready = threading.Event()
+        self._wake = threading.Event()
+        self._rescan = False          # 次の取得で PortMidi を初期化し直すか（利用者の再検索）
+        self._listeners = []
+        self._thread = None
+        self.updated_at = 0.0
+
+    def start(self):
+        """取得スレッドを起動する（起動済みなら何もしない）。"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="midi-devices", daemon=True)
+            self._thread.start()
+
+    def devices(self, timeout=5.0):
+        if not self._ready.is_set():
+            if self._thread is not None and self._thread.is_alive():
+                self._ready.wait(timeout)
+            if not self._ready.is_set():
+                self.refresh(rescan=False)
+        with self._lock:
+            return list(self._devices or [])
+
+    def refresh(self, rescan=True):
+        """今すぐ取り直す（呼んだスレッドで）。rescan=True なら PortMidi を初期化し直してデバイスの抜き差しも拾う。"""
+        if rescan and self._devices is not None:
+            midi_broker().rescan()
+        try:
+            devs = _enumerate_outputs()
+        except Exception:
+            devs = []
+        with self._lock:
+            changed = devs != self._devices
+            self._devices = devs
+            self.updated_at = time.time()
+            listeners = list(self._listeners) if changed else []
+        self._ready.set()
+        for cb in listeners:
+            try:
+                cb(list(devs))
+            except Exception:
+                pass
+        return devs
+
+    def refresh_async(self, rescan=True):
+        if rescan:
+            with self._lock:
+                self._rescan = True
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        self._wake.set()
+
+    def subscribe(self, callback):
+        with self._lock:
+            if callback not in self._listeners:
+                self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                rescan, self._rescan = self._rescan, False
+            self.refresh(rescan=rescan)
+            self._wake.wait()
+            self._wake.clear()
+
+
+_device_cache = None
+
+
+def midi_device_cache() -> MidiDeviceCache:
+    """プロセスで1つのデバイス一覧キャッシュ"""
+    global _device_cache
+    with _broker_lock:
+        if _device_cache is None:
+            _device_cache = MidiDeviceCache()
+        return _device_cache
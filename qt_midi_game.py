@@ -1,10 +1,12 @@
 import sys
 import time
-import random
 import threading
 import os
-from collections import defaultdict
-from midi_utils import list_midi_output_devices, pick_default_midi_out_id, open_output_or_none
+from midi_utils import open_output_or_none, resolve_output_id, output_device_name
+from midi_chart import load_or_compile_chart, NOTE_PENDING, NOTE_HIT, NOTE_MISS
+from midi_song import load_song
+from midi_player import MidiPlayer, ProcessMidiPlayer, OUTPUT_LATENCY_MS
+from game_clock import GameClock, EventTimeMapper, load_output_latency, update_output_latency
 
 from xplatform_window import (
     activate_for_input,
@@ -13,50 +15,18 @@ from xplatform_window import (
 )
 
 import mido
-import pygame
-import pygame.midi
+import numpy as np
 
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QGraphicsView, QGraphicsScene, QGraphicsRectItem,
-    QPushButton, QFileDialog,QVBoxLayout,QGraphicsLineItem
+    QPushButton, QFileDialog,QVBoxLayout,QGraphicsLineItem, QGraphicsItem
 )
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QBrush, QColor, QFont, QPen
-# qt_midi_game.py
+from PyQt5.QtCore import Qt, QTimer, QRectF, QPointF, QObject, QThread, pyqtSignal
+from PyQt5.QtGui import QBrush, QColor, QFont, QPen, QPixmap, QStaticText, QTransform
 try:
-    from midi_utils import pick_default_midi_out_id, open_output_or_none
-except ImportError:
-    import pygame.midi
-    def _safe_midi_init():
-        if not pygame.midi.get_init():
-            pygame.midi.init()
-    def pick_default_midi_out_id(prefer_names=("Microsoft GS Wavetable","MIDI","Synth")):
-        _safe_midi_init()
-        n = pygame.midi.get_count()
-        outs = []
-        for i in range(n):
-            info = pygame.midi.get_device_info(i)
-            if info and info[3]:  # is_output
-                outs.append((i, info[1].decode(errors="ignore")))
-        if not outs: return -1
-        for pid, pname in outs:
-            if any(s.lower() in pname.lower() for s in prefer_names):
-                return pid
-        return outs[0][0]
-    def open_output_or_none(device_id=None):
-        _safe_midi_init()
-        try:
-            if device_id is None or device_id == -1:
-                device_id = pick_default_midi_out_id()
-                if device_id == -1:
-                    device_id = pygame.midi.get_default_output_id()
-            if device_id is None or device_id == -1:
-                return None
-            return pygame.midi.Output(device_id)
-        except Exception:
-            return None
-
-
+    from PyQt5.QtWidgets import QOpenGLWidget
+except ImportError:        # OpenGL 無しのビルド
+    QOpenGLWidget = None
 # ====== デバッグ用：テストMIDI固定パス ======
 TEST_MIDI_PATH = r"C:\Users\tubasa usami\pythoncode\pomodoro\music\45秒で何ができる.mid"
 
@@ -69,9 +39,30 @@ LANE_W = FIELD_W / LANES
 JUDGE_Y = int(FIELD_H * 0.83)      # 判定ライン（下寄り）
 NOTE_W, NOTE_H = 100, 20
 NOTE_SPEED = 300.0
-JUST_PX = 10
-GOOD_PX = 30
+JUST_MS = 33       # 判定幅（±ms）
+GOOD_MS = 100
 AUDIO_DELAY = max((JUDGE_Y - NOTE_H/2) / NOTE_SPEED, 0.0)
+SPAWN_LEAD = NOTE_H / NOTE_SPEED                    # 上端に顔を出す少し前に出現させる
+RETIRE_AFTER = (FIELD_H + NOTE_H / 2) / NOTE_SPEED  # 下端を抜けたら MISS
+JUST_SEC = JUST_MS / 1000.0
+GOOD_SEC = GOOD_MS / 1000.0
+
+# HUD（ラベル, 色, 位置）と判定テキストの色。毎回 QColor を作らないよう定数で持つ
+HUD_LINES = (
+    ("Combo", QColor(0, 0, 0), (16, 16)),
+    ("Just", QColor(0, 170, 0), (16, 48)),
+    ("Good", QColor(220, 180, 0), (16, 80)),
+    ("Miss", QColor(200, 0, 0), (16, 112)),
+)
+JUDGE_COLORS = {"Just": QColor(0, 255, 0), "Good": QColor(255, 255, 0), "Miss": QColor(255, 0, 0)}
+POPUP_SEC = 0.25
+
+# 描画方式： "scene"（QGraphicsScene） / "painter"（1回の paintEvent で一括描画） / "gl"（painter を OpenGL 上で）
+RENDER_MODES = ("scene", "painter", "gl")
+DEFAULT_RENDER_MODE = os.environ.get("BREAKGATE_RENDER", "scene")
+# 再生方式： "thread"（同じプロセスのスレッド） / "process"（別プロセス。GUI の詰まりが音に出ない）
+PLAYBACK_MODES = ("thread", "process")
+DEFAULT_PLAYBACK_MODE = os.environ.get("BREAKGATE_PLAYBACK", "thread")
 def _win_force_topmost(widget, on=True):
     # モジュール内に小さなWin32ヘルパを持たせる
     try:
@@ -93,39 +84,325 @@ def _win_force_topmost(widget, on=True):
 
 
 class NoteItem(QGraphicsRectItem):
-    def __init__(self, start_time, column, width, height):
+    """
+    画面上のノーツ1個（見た目だけ）。時刻・レーン・判定状態は Chart 側の配列が持つ。
+    プールから使い回すので、担当ノーツは bind で差し替える。
+    """
+    def __init__(self, width, height):
         super().__init__(-width/2, -height/2, width, height)
-        self.start_time = start_time  # 秒
-        self.column = column          # 0..3
-        self.hit = False
+        self.index = -1               # 譜面上のインデックス
+
+    def bind(self, index, column, y):
+        self.index = index
+        self.setPos(column * LANE_W + LANE_W / 2, y)
+        self.setVisible(True)
 
 from PyQt5.QtGui import QBrush, QColor, QFont, QPen, QPainter
 
+
+def _prepared_static_text(text, font):
+    st = QStaticText(text)
+    st.setTextFormat(Qt.PlainText)
+    st.prepare(QTransform(), font)
+    return st
+
+
+class StaticTextItem(QGraphicsItem):
+    """
+    QStaticText で描く軽量テキスト（QGraphicsTextItem は内部に文書を持つので重い）。
+    set_text は内容が変わったときだけレイアウトし直す。
+    cache_labels=True なら文字列ごとの QStaticText を使い回す（判定テキスト用）。
+    """
+    def __init__(self, font, color, cache_labels=False, parent=None):
+        super().__init__(parent)
+        self._font = font
+        self._color = color
+        self._text = None
+        self._st = None
+        self._rect = QRectF()
+        self._cache = {} if cache_labels else None
+
+    def set_text(self, text, color=None):
+        if color is not None and color is not self._color:
+            self._color = color
+            self.update()
+        if text == self._text:
+            return
+        self.prepareGeometryChange()
+        self._text = text
+        if self._cache is not None:
+            st = self._cache.get(text)
+            if st is None:
+                st = self._cache[text] = _prepared_static_text(text, self._font)
+        else:
+            st = _prepared_static_text(text, self._font)
+        self._st = st
+        size = st.size()
+        self._rect = QRectF(0, 0, size.width(), size.height())
+        self.update()
+
+    def boundingRect(self):
+        return self._rect
+
+    def paint(self, painter, option, widget=None):
+        if self._st is None:
+            return
+        painter.setFont(self._font)
+        painter.setPen(self._color)
+        painter.drawStaticText(QPointF(0, 0), self._st)
+
+
+# ====== 一括描画レンダラ（QGraphicsScene を使わないモード） ======
+class _HighwayPainter:
+    """
+    フィールド全体（背景・ノーツ・HUD・判定テキスト）を 1 回の描画でまとめて描く。
+    レーン線・判定ラインなど動かない部分は、表示サイズごとに pixmap にキャッシュする。
+    """
+    NOTE_BRUSH = QColor(0, 204, 255)
+    NOTE_PEN = QPen(QColor(0, 0, 0))   # シーン版と同じ細い縁取り
+
+    def _init_highway(self, game):
+        self.game = game
+        self._bg = None
+        self._bg_key = None
+        self.setFocusPolicy(Qt.NoFocus)
+
+    def _field_geometry(self):
+        # FIELD_W×FIELD_H を縦横比を保って中央にフィット（余白は白）
+        w, h = self.width(), self.height()
+        sc = min(w / FIELD_W, h / FIELD_H) if w and h else 1.0
+        return sc, (w - FIELD_W * sc) / 2, (h - FIELD_H * sc) / 2
+
+    def _background(self, sc, ox, oy):
+        dpr = self.devicePixelRatioF()
+        key = (self.width(), self.height(), dpr)
+        if self._bg is not None and self._bg_key == key:
+            return self._bg
+        pm = QPixmap(max(1, int(self.width() * dpr)), max(1, int(self.height() * dpr)))
+        pm.setDevicePixelRatio(dpr)
+        pm.fill(QColor(255, 255, 255))
+        p = QPainter(pm)
+        p.translate(ox, oy)
+        p.scale(sc, sc)
+        pen = QPen(QColor(0, 0, 0)); pen.setWidth(2)
+        p.setPen(pen)
+        p.drawLine(0, JUDGE_Y, FIELD_W, JUDGE_Y)
+        grid_pen = QPen(QColor(80, 80, 80)); grid_pen.setWidth(1)
+        p.setPen(grid_pen)
+        for i in range(LANES + 1):
+            x = int(i * LANE_W)
+            p.drawLine(x, 0, x, FIELD_H)
+        p.end()
+        self._bg, self._bg_key = pm, key
+        return pm
+
+    def paint_field(self, p):
+        game = self.game
+        sc, ox, oy = self._field_geometry()
+        p.drawPixmap(0, 0, self._background(sc, ox, oy))
+        p.translate(ox, oy)
+        p.scale(sc, sc)
+
+        # ノーツ（画面上のぶんをまとめて1回で）
+        xs, ys = game.visible_note_positions()
+        if len(xs):
+            rects = [QRectF(x - NOTE_W / 2, y - NOTE_H / 2, NOTE_W, NOTE_H)
+                     for x, y in zip(xs.tolist(), ys.tolist())]
+            p.setPen(self.NOTE_PEN)
+            p.setBrush(self.NOTE_BRUSH)
+            p.drawRects(rects)
+
+        # HUD と判定テキスト（レイアウト済みの QStaticText を置くだけ）
+        p.setFont(game.font)
+        for st, color, x, y in game.overlay_texts():
+            p.setPen(color)
+            p.drawStaticText(QPointF(x, y), st)
+
+
+class HighwayCanvas(_HighwayPainter, QWidget):
+    def __init__(self, game, parent=None):
+        super().__init__(parent)
+        self._init_highway(game)
+        self.setAttribute(Qt.WA_OpaquePaintEvent, True)   # 背景は自前で全面を描く
+        self.setAttribute(Qt.WA_NoSystemBackground, True)
+
+    def paintEvent(self, e):
+        p = QPainter(self)
+        self.paint_field(p)
+        p.end()
+
+
+if QOpenGLWidget is not None:
+    class HighwayGLCanvas(_HighwayPainter, QOpenGLWidget):
+        def __init__(self, game, parent=None):
+            super().__init__(parent)
+            self._init_highway(game)
+
+        def paintGL(self):
+            p = QPainter(self)
+            self.paint_field(p)
+            p.end()
+else:
+    HighwayGLCanvas = None
+
+
+def prepare_song_and_chart(midi_path, difficulty="Normal", song=None):
+    """
+    曲の解析と譜面生成（キャッシュがあれば読むだけ）。Qt を触らないので別スレッドから呼んでよい。
+    戻り値: (MidiSong, Chart)
+    """
+    if song is None:
+        song = load_song(midi_path)
+    chart = load_or_compile_chart(midi_path, difficulty, LANES, song=song)
+    return song, chart
+
+
+def open_game_output(midi_out_id=None):
+    """
+    ゲーム用の MIDI 出力を借りる（ブローカー経由。開いたままのデバイスならコストはほぼ 0）。
+    指定が無ければ優先名→pygame のデフォルトの順。戻り値: (ハンドル または None, デバイス名 または None)
+    """
+    out = open_output_or_none(midi_out_id)
+    return (out, out.name) if out is not None else (None, None)
+
+
 class MidiGame(QWidget):
-    def __init__(self, midi_path, preview_mode=False, difficulty="Normal",midi_out_id=None):
+    def __init__(self, midi_path, preview_mode=False, difficulty="Normal",midi_out_id=None,
+                 output_latency=None, render_mode=None, song=None, chart=None, output=None,
+                 autostart=True, playback=None):
+        """
+        song / chart を渡すと読み込み・譜面生成を省く（別スレッドで用意しておく場合）。
+        output に (Output, デバイス名) を渡すとデバイスを開かずにそれを使う。
+        autostart=False なら準備だけして止めておき、start() で開始する。
+        playback="process" なら再生は別プロセスで行い、出力デバイスもそちらで開く。
+        """
         super().__init__()
         self.setWindowTitle("PyQt MIDI Game")
 
         self.preview_mode = preview_mode
         self.difficulty = difficulty
         self.font = QFont("Arial", 18)
+        self.setFocusPolicy(Qt.StrongFocus)
 
-        # --- Scene / View ---
+        # ★ ウィンドウいっぱいに描画面を広げる
+        lay = QVBoxLayout(self)
+        lay.setContentsMargins(0, 0, 0, 0)
+        lay.setSpacing(0)
+
+        self.combo = 0; self.just = 0; self.good = 0; self.miss = 0
+        self._hud_values = None                 # 最後に表示した HUD の値（変化したときだけ更新）
+        self._hud_static = [None] * len(HUD_LINES)
+        self._popup_label = [None] * LANES      # レーンごとの判定テキスト（固定枠を使い回す）
+        self._popup_expire = [0.0] * LANES
+        self._popup_static = {}                 # 一括描画用：判定ラベル → QStaticText
+        self._frame_now = 0.0
+
+        self.render_mode = render_mode or DEFAULT_RENDER_MODE
+        if self.render_mode == "gl" and HighwayGLCanvas is None:
+            self.render_mode = "painter"
+        if self.render_mode in ("painter", "gl"):
+            # 一括描画モード：シーンは作らない
+            self.scene = None
+            self.view = None
+            self.field_root = None
+            canvas_cls = HighwayGLCanvas if self.render_mode == "gl" else HighwayCanvas
+            self.canvas = canvas_cls(self, self)
+            lay.addWidget(self.canvas)
+        else:
+            self.canvas = None
+            self._build_scene(lay)
+
+        # MIDI 読み込み・ノーツ作成（譜面はキャッシュがあればそれを使う）
+        # 曲は一度だけ解析し、譜面生成と再生で同じタイムラインを使う
+        self.midi_path = midi_path
+        if song is None or chart is None:
+            song, chart = prepare_song_and_chart(midi_path, difficulty, song=song)
+        self.song = song
+        self._prepare_notes(chart)
+
+        # MIDI 出力（タイムスタンプ付き送出のため latency 付きで開く）
+        self.playback = playback or DEFAULT_PLAYBACK_MODE
+        if self.playback == "process":
+            # デバイスは再生プロセスが開く（同じデバイスを親子で取り合わない）
+            if output is not None and output[0] is not None:
+                output[0].close()
+            self.midi_out_id = resolve_output_id(midi_out_id)
+            self.midi_out, self.midi_out_name = None, output_device_name(self.midi_out_id)
+        else:
+            if output is None:
+                output = open_game_output(midi_out_id)
+            self.midi_out, self.midi_out_name = output
+
+        # プレビュー時のフラグ（以前の通り）
+        if preview_mode:
+            # 旧：flags 直書き
+            # 新：統一API
+            make_click_through(self, True, keep_topmost=True)
+        else:
+            # ゲーム本番時はフラグ極力いじらない（TopMostを要求しない）
+            self.setWindowFlags(Qt.Window | Qt.WindowTitleHint | Qt.WindowCloseButtonHint)
+
+        # ゲームループ（描画・判定・再生はすべて同じ GameClock を読む）
+        # 曲の t 秒のノーツが判定ラインに来るのは start + t + AUDIO_DELAY。
+        # 音はデバイスの出力遅延ぶん早めに送る（未指定なら保存済みの補正値）
+        if output_latency is None:
+            output_latency = load_output_latency(self.midi_out_name)
+        self.clock = GameClock(lead_in=AUDIO_DELAY, output_latency=output_latency)
+        self.start_time = None
+        self._hit_offsets = []   # ヒット時のズレ（秒, 正=遅押し）→ 終了時に遅延補正へ反映
+        self._input_time = EventTimeMapper(self.clock.now)   # キーイベント時刻 → clock 時刻
+        if self.playback == "process":
+            self.player = ProcessMidiPlayer(self.song, self.midi_out_id, latency_ms=OUTPUT_LATENCY_MS,
+                                            clock=self.clock.now)
+        else:
+            self.player = MidiPlayer(self.song, self.midi_out, latency_ms=OUTPUT_LATENCY_MS,
+                                     clock=self.clock.now)
+
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)   # 粗いタイマーだと 60fps を割る環境がある
+        self.timer.timeout.connect(self._update_game)
+
+        # 初回フィット（フルスクリーン後にも再フィットされるよう保険）
+        QTimer.singleShot(0, self._fit_view)
+        if autostart:
+            self.start()
+
+    def start(self, offset=0.0):
+        """
+        時計・再生・ゲームループを開始する（2回目以降は何もしない）。
+        offset（曲の秒）を渡すとそこから始める（サビからの練習など）。それより前のノーツは判定しない。
+        """
+        if self.start_time is not None:
+            return
+        if self.playback == "process":
+            # 子プロセスの起動が間に合わないと頭の音が遅れる。出力を開けなかったら知らせる（無音で進む）
+            if not self.player.wait_ready() and self.player.error:
+                print(f"[WARN] MIDI playback process: {self.player.error}")
+        offset = max(0.0, float(offset))
+        if offset > 0:
+            self._spawn_cursor = self._retire_cursor = self.chart.skip_before(offset)
+        # 経過 offset 秒の状態から始める → 曲の offset 秒はいつもどおり lead_in 後に鳴る
+        self.start_time = self.clock.start(offset=offset)
+        self.player.start(at=self.clock.audio_start() + offset, offset=offset)
+        self.timer.start(16)
+
+    def is_started(self):
+        return self.start_time is not None
+        
+        # ゲームクラス内（__init__の下あたり）に追加
+    
+    # ====== QGraphicsScene モードの構築 ======
+    def _build_scene(self, lay):
         self.scene = QGraphicsScene(0, 0, FIELD_W, FIELD_H)
+        self.scene.setItemIndexMethod(QGraphicsScene.NoIndex)   # 毎フレーム動くので空間インデックスは不要
         self.view = QGraphicsView(self.scene, self)
         self.view.setViewportUpdateMode(QGraphicsView.FullViewportUpdate)
         self.view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.view.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.view.setFocusPolicy(Qt.NoFocus)
-        self.setFocusPolicy(Qt.StrongFocus)
         self.view.setBackgroundBrush(QBrush(QColor(255, 255, 255)))  # ← 余白は白
         self.view.setAlignment(Qt.AlignCenter)                       # ← 中央寄せ
         self.view.setRenderHint(QPainter.Antialiasing, False)        # くっきり
-        
-            # ★ これを追加：ウィンドウいっぱいに View を広げる
-        lay = QVBoxLayout(self)
-        lay.setContentsMargins(0, 0, 0, 0)
-        lay.setSpacing(0)
         lay.addWidget(self.view)
 
         # ここがポイント：フィールド用のルート
@@ -148,68 +425,23 @@ class MidiGame(QWidget):
 
 
         # スコア UI（フィールド内の固定座標）
-        self.combo = 0; self.just = 0; self.good = 0; self.miss = 0
-        self.text_combo = self.scene.addText("Combo: 0", self.font)
-        self.text_combo.setDefaultTextColor(QColor(0,0,0))
-        self.text_combo.setPos(12, 12)
-        self.text_just = self.scene.addText("Just: 0", self.font)
-        self.text_just.setDefaultTextColor(QColor(0,170,0))
-        self.text_just.setPos(12, 44)
-        self.text_good = self.scene.addText("Good: 0", self.font)
-        self.text_good.setDefaultTextColor(QColor(220,180,0))
-        self.text_good.setPos(12, 76)
-        self.text_miss = self.scene.addText("Miss: 0", self.font)
-        self.text_miss.setDefaultTextColor(QColor(200,0,0))
-        self.text_miss.setPos(12, 108)
-
-        self.floating_texts = []
-
-        # MIDI 読み込み・ノーツ作成（既存ロジックをそのまま）
-        self.midi_for_gen = mido.MidiFile(midi_path)
-        self.midi_for_play = mido.MidiFile(midi_path)
-        self.notes = []
-        self._prepare_notes()
-
-        # MIDI 出力（既存のまま）
-        self.midi_out = None
-        try:
-            pygame.midi.init()
-            # 指定があればそれを使う、なければ優先名で決め打ち
-            if midi_out_id is None:
-                midi_out_id = pick_default_midi_out_id()
-            if midi_out_id != -1:
-                self.midi_out = pygame.midi.Output(midi_out_id)
-            else:
-                # 最後の保険：pygameのデフォルト（-1の場合多い）
-                default_id = pygame.midi.get_default_output_id()
-                if default_id != -1:
-                    self.midi_out = pygame.midi.Output(default_id)
-        except Exception:
-            self.midi_out = None
-
-        # プレビュー時のフラグ（以前の通り）
-        if preview_mode:
-            # 旧：flags 直書き
-            # 新：統一API
-            make_click_through(self, True, keep_topmost=True)
-        else:
-            # ゲーム本番時はフラグ極力いじらない（TopMostを要求しない）
-            self.setWindowFlags(Qt.Window | Qt.WindowTitleHint | Qt.WindowCloseButtonHint)
-
-        # ゲームループ
-        self.start_time = time.time()
-        self.midi_thread = threading.Thread(target=self._play_midi_thread, daemon=True)
-        self.midi_thread.start()
-
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self._update_game)
-        self.timer.start(16)
+        self._hud_items = []
+        for label, color, (x, y) in HUD_LINES:
+            item = StaticTextItem(self.font, color)
+            item.setPos(x, y)
+            self.scene.addItem(item)
+            self._hud_items.append(item)
+        self.text_combo, self.text_just, self.text_good, self.text_miss = self._hud_items
+
+        # 判定テキストはレーンごとに1つだけ持って使い回す
+        self._popup_items = []
+        for col in range(LANES):
+            item = StaticTextItem(self.font, JUDGE_COLORS["Miss"], cache_labels=True)
+            item.setPos(col * LANE_W + LANE_W / 2 - 24, JUDGE_Y - 48)
+            item.setParentItem(self.field_root)
+            item.setVisible(False)
+            self._popup_items.append(item)
 
-        # 初回フィット（フルスクリーン後にも再フィットされるよう保険）
-        QTimer.singleShot(0, self._fit_view)
-        
-        # ゲームクラス内（__init__の下あたり）に追加
-    
     def set_click_through(self, on: bool):
         """プレビュー用クリック透過 ON/OFF（OFF時は“ふつうのウィンドウ”に戻す）"""
         # まず属性
@@ -247,6 +479,8 @@ class MidiGame(QWidget):
         
     # ここ“だけ”をフィット対象にする（周りは白余白）
     def _fit_view(self):
+        if self.view is None:
+            return   # 一括描画モードはキャンバス側が毎回フィットする
         # field_root の『シーン座標の矩形』を取得して fit
         rect = self.field_root.mapRectToScene(self.field_root.rect())
         self.view.setSceneRect(self.scene.sceneRect())
@@ -264,80 +498,129 @@ class MidiGame(QWidget):
 
 
 
-    # ====== ノーツ生成（Pygame版の時間バケツ方式を移植） ======
-    def _prepare_notes(self):
-        bucket = {"Easy": 0.5, "Normal": 0.15, "Hard": 0.1}.get(self.difficulty, 0.15)
-        times, t = [], 0.0
-        for msg in self.midi_for_gen:
-            t += msg.time
-            if msg.type == "note_on" and getattr(msg, "velocity", 0) > 0:
-                times.append(t)
-
-        from collections import defaultdict
-        import random
-        buckets = defaultdict(list)
-        for tt in times:
-            key = round(tt / bucket) * bucket
-            buckets[key].append(tt)
-        filtered_times = [random.choice(arr) for _, arr in sorted(buckets.items())]
-
-        last = []
-        for tt in filtered_times:
-            candidates = list(range(LANES))
-            if len(last) >= 2 and last[-1] == last[-2]:
-                candidates = [c for c in candidates if c != last[-1]]
-            col = random.choice(candidates)
-            last.append(col)
-            lane_x = col * LANE_W + LANE_W / 2
-            note = NoteItem(tt, col, NOTE_W, NOTE_H)
-            note.setBrush(QBrush(QColor(0, 204, 255)))
-            note.setPos(lane_x, -50)
-            note.setParentItem(self.field_root)  # ★ ここがポイント（相対座標に）
-            #self.scene.addItem(note)
-            self.notes.append(note)
-
-    # ====== MIDI送出（mido→pygame.midi） ======
-    def _play_midi_thread(self):
-        time.sleep(AUDIO_DELAY)
-        start = time.time()
-        # mido.MidiFile.play() は時刻調整済みで順にyieldされる
-        for msg in self.midi_for_play.play(meta_messages=True):
-            if msg.type in ("note_on", "note_off") and self.midi_out:
-                status = 0x90 if msg.type == "note_on" else 0x80
-                note = getattr(msg, "note", 0)
-                vel = getattr(msg, "velocity", 0)
-                try:
-                    self.midi_out.write_short(status, note, vel)
-                except Exception:
-                    pass
-            # msg.time は「次のメッセージまでの秒」だが、play()がsleep調整するのでここは不要
-            # （別スレッドなのでここでsleepしない）
+    # ====== ノーツ生成（時間バケツ方式。生成結果はディスクにキャッシュ） ======
+    def _prepare_notes(self, chart):
+        # 譜面は時刻順の配列（Chart）のまま持ち、画面に出すぶんだけ NoteItem を割り当てる
+        self.chart = chart
+        self._spawn_cursor = 0    # 次に出現させるノーツ
+        self._retire_cursor = 0   # これより前はすべて判定済み
+        self._active = {}         # index -> NoteItem（画面上のノーツ）
+        self._note_pool = []      # 使い終わった NoteItem
+
+        # ノーツは「-時刻×速度」に固定配置し、この層ごと now×速度 だけ下げてスクロールする
+        # → 毎フレーム触る Qt アイテムはこの1つだけ（一括描画モードでは不要）
+        self.note_layer = None
+        if self.scene is not None:
+            self.note_layer = QGraphicsRectItem(0, 0, 0, 0)
+            self.note_layer.setPen(QPen(Qt.NoPen))
+            self.note_layer.setFlag(QGraphicsRectItem.ItemHasNoContents, True)
+            self.note_layer.setParentItem(self.field_root)
+
+        # レーンごとの時刻配列（判定は searchsorted で探す）
+        self._lane_index = [self.chart.lane_indices(c) for c in range(LANES)]
+        self._lane_times = [self.chart.times[idx] for idx in self._lane_index]
+        self._lane_next = [0] * LANES   # レーンごとの「未判定の先頭」
+
+    def visible_note_positions(self):
+        """一括描画用：画面上の未判定ノーツの中心座標 (xs, ys)（フィールド座標）"""
+        lo, hi = self._retire_cursor, self._spawn_cursor
+        idx = np.arange(lo, hi)
+        idx = idx[self.chart.state[lo:hi] == NOTE_PENDING]
+        xs = self.chart.lanes[idx] * LANE_W + LANE_W / 2
+        ys = (self._frame_now - self.chart.times[idx]) * NOTE_SPEED
+        return xs, ys
+
+    def overlay_texts(self):
+        """一括描画用：HUD と判定テキスト → [(QStaticText, color, x, y)]"""
+        out = [(st, color, x, y)
+               for st, (_, color, (x, y)) in zip(self._hud_static, HUD_LINES) if st is not None]
+        for col, popup in enumerate(self._popup_label):
+            if popup is None:
+                continue
+            text, color = popup
+            st = self._popup_static.get(text)
+            if st is None:
+                st = self._popup_static[text] = _prepared_static_text(text, self.font)
+            out.append((st, color, col * LANE_W + LANE_W / 2 - 24, JUDGE_Y - 48))
+        return out
+
+    def _acquire_note_item(self, index, y):
+        if self._note_pool:
+            item = self._note_pool.pop()
+        else:
+            item = NoteItem(NOTE_W, NOTE_H)
+            item.setBrush(QBrush(QColor(0, 204, 255)))
+            item.setParentItem(self.note_layer)
+        item.bind(index, int(self.chart.lanes[index]), y)
+        self._active[index] = item
+        return item
+
+    def _release_note(self, index, state=NOTE_HIT):
+        self.chart.state[index] = state
+        item = self._active.pop(index, None)
+        if item is not None:
+            item.setVisible(False)
+            self._note_pool.append(item)
 
     # ====== ゲーム更新・ミス判定 ======
     def _update_game(self):
-        now = time.time() - self.start_time
-        # ノーツ位置更新
-        for note in self.notes:
-            if note.hit:
-                continue
-            y = (now - note.start_time) * NOTE_SPEED
-            note.setY(y)
-            # 画面下に抜けたらMISS
-            if y - NOTE_H/2 > FIELD_H:
-                note.hit = True
-                note.setVisible(False)
+        now = self.clock.elapsed()
+        chart = self.chart
+        times, state = chart.times, chart.state
+
+        # 見える範囲に入ったノーツだけを出現させる（配置位置は一括計算）
+        spawn_to = int(np.searchsorted(times, now + SPAWN_LEAD, side="right"))
+        if spawn_to > self._spawn_cursor:
+            new = np.arange(self._spawn_cursor, spawn_to)
+            new = new[state[new] == NOTE_PENDING]
+            if self.note_layer is not None:
+                ys = -times[new] * NOTE_SPEED
+                for index, y in zip(new.tolist(), ys.tolist()):
+                    self._acquire_note_item(index, y)
+            self._spawn_cursor = spawn_to
+
+        # 画面下に抜けたらMISS（出現済みの範囲だけを一括判定）
+        lo, hi = self._retire_cursor, self._spawn_cursor
+        if hi > lo:
+            pending = state[lo:hi] == NOTE_PENDING
+            late = np.flatnonzero(pending & (times[lo:hi] < now - RETIRE_AFTER)) + lo
+            for index in late.tolist():
+                self._release_note(index, NOTE_MISS)
                 self.miss += 1
                 self.combo = 0
-                self._spawn_floating_text("Miss", note.column, QColor(255, 0, 0))
+                self._spawn_floating_text("Miss", int(chart.lanes[index]), JUDGE_COLORS["Miss"])
+            # 判定済みの先頭を進める
+            pending = np.flatnonzero(state[lo:hi] == NOTE_PENDING)
+            self._retire_cursor = lo + int(pending[0]) if len(pending) else hi
+
+        # ノーツ層をスクロール（一括描画モードは再描画を依頼するだけ）
+        self._frame_now = now
+        if self.note_layer is not None:
+            self.note_layer.setY(now * NOTE_SPEED)
 
         # フローティングテキストの寿命管理
         self._gc_floating_texts()
 
-        # スコア表示更新
-        self.text_combo.setPlainText(f"Combo: {self.combo}")
-        self.text_just.setPlainText(f"Just: {self.just}")
-        self.text_good.setPlainText(f"Good: {self.good}")
-        self.text_miss.setPlainText(f"Miss: {self.miss}")
+        # スコア表示更新（値が変わった行だけ）
+        self._update_hud()
+
+        if self.canvas is not None:
+            self.canvas.update()
+
+    def _update_hud(self):
+        values = (self.combo, self.just, self.good, self.miss)
+        old = self._hud_values
+        if values == old:
+            return
+        for i, ((label, _, _), v) in enumerate(zip(HUD_LINES, values)):
+            if old is not None and old[i] == v:
+                continue
+            text = f"{label}: {v}"
+            if self.canvas is not None:
+                self._hud_static[i] = _prepared_static_text(text, self.font)
+            else:
+                self._hud_items[i].set_text(text)
+        self._hud_values = values
 
     # ====== キー入力→判定 ======
     def keyPressEvent(self, e):
@@ -349,65 +632,89 @@ class MidiGame(QWidget):
             return
 
         col = keymap[e.key()]
-        # 最も判定ラインに近いアクティブノーツを探す
-        target = None
-        best_delta = 1e9
-        for note in self.notes:
-            if note.hit or note.column != col:
-                continue
-            center_y = note.y() + NOTE_H/2
-            delta = abs(center_y - JUDGE_Y)
-            if delta < best_delta:
-                best_delta = delta
-                target = note
+        # 判定は「キーが押された瞬間」で行う（タイマーの描画周期に依存しない）
+        now = self.clock.elapsed(self._input_time.map(e.timestamp()))
+        target, offset = self._find_judge_target(col, now)
 
-        if not target:
+        if target is None:
             # 可視ノーツがない → ミス
             self.miss += 1
             self.combo = 0
-            self._spawn_floating_text("Miss", col, QColor(255, 0, 0))
+            self._spawn_floating_text("Miss", col, JUDGE_COLORS["Miss"])
             return
 
-        if best_delta <= JUST_PX:
-            target.hit = True
-            target.setVisible(False)
+        best_delta = abs(offset)
+        if best_delta <= JUST_SEC:
+            self._release_note(target)
+            self._hit_offsets.append(offset)
             self.just += 1
             self.combo += 1
-            self._spawn_floating_text("Just", col, QColor(0, 255, 0))
-        elif best_delta <= GOOD_PX:
-            target.hit = True
-            target.setVisible(False)
+            self._spawn_floating_text("Just", col, JUDGE_COLORS["Just"])
+        elif best_delta <= GOOD_SEC:
+            self._release_note(target)
+            self._hit_offsets.append(offset)
             self.good += 1
             self.combo += 1
-            self._spawn_floating_text("Good", col, QColor(255, 255, 0))
+            self._spawn_floating_text("Good", col, JUDGE_COLORS["Good"])
         else:
             # 判定圏外
             self.miss += 1
             self.combo = 0
-            self._spawn_floating_text("Miss", col, QColor(255, 0, 0))
+            self._spawn_floating_text("Miss", col, JUDGE_COLORS["Miss"])
+
+    def _find_judge_target(self, col, now):
+        """
+        レーン col で判定ラインに最も近い未判定ノーツを返す → (index, 秒差)。
+        秒差は「押した時刻 − 判定時刻」（正=遅押し）。
+        now は押した瞬間の経過秒。画面に出ていないノーツは対象外。無ければ (None, None)。
+        """
+        times = self._lane_times[col]
+        idxs = self._lane_index[col]
+        state = self.chart.state
+        n = len(idxs)
+        # 先頭の判定済みを読み飛ばす（ポインタは戻らないので全体で O(n)）
+        p = self._lane_next[col]
+        while p < n and state[idxs[p]] != NOTE_PENDING:
+            p += 1
+        self._lane_next[col] = p
+
+        # ノーツ時刻 t が判定ラインに来るのは t + AUDIO_DELAY
+        target_t = now - AUDIO_DELAY
+        k = int(np.searchsorted(times[p:], target_t)) + p
+        best, best_offset = None, 0.0
+        # 左（もう通り過ぎた側）で最も近い未判定
+        j = k - 1
+        while j >= p and state[idxs[j]] != NOTE_PENDING:
+            j -= 1
+        if j >= p:
+            best, best_offset = int(idxs[j]), target_t - float(times[j])
+        # 右（これから来る側）で最も近い未判定（その時点で画面に出ているものだけ）
+        j = k
+        while j < n and state[idxs[j]] != NOTE_PENDING:
+            j += 1
+        if j < n and times[j] <= now + SPAWN_LEAD:
+            offset = target_t - float(times[j])
+            if best is None or -offset < abs(best_offset):
+                best, best_offset = int(idxs[j]), offset
+        return best, (best_offset if best is not None else None)
 
     # ====== 判定テキスト ======
     def _spawn_floating_text(self, text, col, color):
-        x = col * LANE_W + LANE_W / 2
-        titem = self.scene.addText(text, self.font)
-        titem.setDefaultTextColor(color)
-        titem.setPos(x - 24, JUDGE_Y - 48)
-        titem.setParentItem(self.field_root)   # ← 追加
-        expire = time.time() + 0.25
-        self.floating_texts.append((titem, expire))
-
-
-
+        # レーンごとの固定枠を上書きするだけ（キー入力ごとに Qt オブジェクトを作らない）
+        self._popup_label[col] = (text, color)
+        self._popup_expire[col] = self.clock.now() + POPUP_SEC
+        if self.canvas is None:
+            item = self._popup_items[col]
+            item.set_text(text, color)
+            item.setVisible(True)
 
     def _gc_floating_texts(self):
-        now = time.time()
-        alive = []
-        for item, exp in self.floating_texts:
-            if now > exp:
-                self.scene.removeItem(item)
-                continue
-            alive.append((item, exp))
-        self.floating_texts = alive
+        now = self.clock.now()
+        for col in range(LANES):
+            if self._popup_label[col] is not None and now > self._popup_expire[col]:
+                self._popup_label[col] = None
+                if self.canvas is None:
+                    self._popup_items[col].setVisible(False)
 
     # ====== プレビュー解除（フォーカス確保含む） ======
 
@@ -432,27 +739,34 @@ class MidiGame(QWidget):
 
 
     def _focus_game_window(self):
-        self.view.clearFocus()
+        if self.view is not None:
+            self.view.clearFocus()
         #self.raise_()
         self.activateWindow()
         self.setFocus(Qt.ActiveWindowFocusReason)
         #QTimer.singleShot(0,   lambda: (self.raise_(), self.activateWindow(), self.setFocus(Qt.ActiveWindowFocusReason)))
         #QTimer.singleShot(120, lambda: (self.raise_(), self.activateWindow(), self.setFocus(Qt.ActiveWindowFocusReason)))
 
-    # ====== 終了処理（pygame.midiのガード含む） ======
+    # ====== 終了処理 ======
     def closeEvent(self, e):
         try:
             self.timer.stop()
         except Exception:
             pass
         try:
-            if self.midi_out:
-                self.midi_out.close()
+            self.player.stop()
         except Exception:
             pass
+        # 今回のヒットのズレから、この出力デバイスの遅延補正を学習（閉じ直しても1プレイ1回だけ。始めていなければしない）
+        offsets, self._hit_offsets = self._hit_offsets, []
+        if not self.preview_mode and self.is_started() and offsets:
+            try:
+                update_output_latency(self.midi_out_name, offsets)
+            except Exception:
+                pass
         try:
-            if pygame.midi.get_init():
-                pygame.midi.quit()
+            if self.midi_out:
+                self.midi_out.close()   # ブローカーへ返す（All Notes Off 付き）。PortMidi は終了しない
         except Exception:
             pass
         try:
@@ -464,6 +778,159 @@ class MidiGame(QWidget):
   
 
 
+# =========================
+# 非同期の組み立て（曲 → 譜面 → 出力 → 画面）
+# =========================
+class _GameLoadThread(QThread):
+    stage = pyqtSignal(int)
+    loaded = pyqtSignal(object, object, object)   # (MidiSong, Chart, (Output, 名前))
+    error = pyqtSignal(str)
+
+    def __init__(self, midi_path, difficulty, midi_out_id, cancel_event, open_output=True, parent=None):
+        super().__init__(parent)
+        self.midi_path = midi_path
+        self.difficulty = difficulty
+        self.midi_out_id = midi_out_id
+        self.open_output = open_output
+        self._cancel = cancel_event
+
+    def run(self):
+        output = (None, None)
+        try:
+            self.stage.emit(0)
+            song = load_song(self.midi_path)
+            if self._cancel.is_set():
+                return
+            self.stage.emit(1)
+            _, chart = prepare_song_and_chart(self.midi_path, self.difficulty, song=song)
+            if self._cancel.is_set():
+                return
+            self.stage.emit(2)
+            if self.open_output:
+                output = open_game_output(self.midi_out_id)
+            else:
+                # 開くのは再生プロセス。ID の決定（デバイス一覧を待つことがある）だけここで済ませる
+                self.midi_out_id = resolve_output_id(self.midi_out_id)
+            if self._cancel.is_set():
+                _close_output(output[0])
+                return
+            self.loaded.emit(song, chart, output)
+        except Exception as ex:
+            _close_output(output[0])
+            self.error.emit(f"{type(ex).__name__}: {ex}")   # str(EOFError()) などは空になる
+
+
+def _close_output(out):
+    try:
+        if out is not None:
+            out.close()
+    except Exception:
+        pass
+
+
+class MidiGameLoader(QObject):
+    """
+    MidiGame を段階的に組み立てる。曲の解析・譜面生成・出力のオープンは別スレッドで、
+    画面（シーン）の構築だけ GUI スレッドで行う。できあがった MidiGame は autostart=False のまま渡す。
+      progress(段階, 段階数, 表示名) / ready(MidiGame) / failed(メッセージ)
+    失敗したら error にメッセージを残す（誰もつないでいない間に failed が出ても後から分かるように）。
+    cancel() するとそれ以降の段階は行わず、開いた出力や作りかけの窓は閉じる。
+    """
+    STAGES = ("曲を読み込み中", "譜面を作成中", "MIDI 出力を準備中", "画面を作成中")
+
+    progress = pyqtSignal(int, int, str)
+    ready = pyqtSignal(object)
+    failed = pyqtSignal(str)
+
+    def __init__(self, midi_path, difficulty="Normal", midi_out_id=None, parent=None, **game_kwargs):
+        super().__init__(parent)
+        self.midi_path = midi_path
+        self.difficulty = difficulty
+        self.midi_out_id = midi_out_id
+        self.game_kwargs = game_kwargs
+        self.game = None
+        self.error = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        playback = self.game_kwargs.get("playback") or DEFAULT_PLAYBACK_MODE
+        th = _GameLoadThread(self.midi_path, self.difficulty, self.midi_out_id, self._cancel,
+                             open_output=(playback != "process"))
+        th.stage.connect(self._on_stage)
+        th.loaded.connect(self._on_loaded)
+        th.error.connect(self._on_error)
+        self._thread = th
+        th.start()
+
+    def is_cancelled(self):
+        return self._cancel.is_set()
+
+    def is_done(self):
+        return self.game is not None
+
+    def is_failed(self):
+        return self.error is not None
+
+    def cancel(self):
+        self._cancel.set()
+        game, self.game = self.game, None
+        if game is not None:
+            try:
+                game.close()
+            except Exception:
+                pass
+
+    def take(self):
+        """できあがった MidiGame を引き取る（以後 cancel() しても閉じない）。"""
+        game, self.game = self.game, None
+        return game
+
+    def dispose(self):
+        """もう使わない組み立てを片付ける（スレッドが走っていれば終わってから消す。待たない）"""
+        th = self._thread
+        if th is not None and th.isRunning():
+            th.finished.connect(self.deleteLater)
+        else:
+            self.deleteLater()
+
+    def wait(self, msecs=3000):
+        th = self._thread
+        if th is not None:
+            th.wait(msecs)
+
+    def _on_stage(self, i):
+        if not self._cancel.is_set():
+            self.progress.emit(i + 1, len(self.STAGES), self.STAGES[i])
+
+    def _on_error(self, msg):
+        if not self._cancel.is_set():
+            self._fail(msg)
+
+    def _fail(self, msg):
+        self.error = msg
+        self.failed.emit(msg)
+
+    def _on_loaded(self, song, chart, output):
+        if self._cancel.is_set():
+            _close_output(output[0])
+            return
+        self._on_stage(3)
+        self.midi_out_id = self._thread.midi_out_id
+        try:
+            game = MidiGame(self.midi_path, preview_mode=False, difficulty=self.difficulty,
+                            midi_out_id=self.midi_out_id, song=song, chart=chart, output=output,
+                            autostart=False, **self.game_kwargs)
+        except Exception as ex:
+            _close_output(output[0])
+            self._fail(f"{type(ex).__name__}: {ex}")
+            return
+        self.game = game
+        self.ready.emit(game)
+
+
 # =========================
 # スタンドアロン実行（デバッグ）
 # =========================
@@ -480,7 +947,8 @@ def _debug_generate_midi(path="generated_test.mid"):
     mid.save(path)
     return path
 
-def debug_run(midi_path=None, preview=False, choose=False, use_test_default=True, difficulty="Normal"):
+def debug_run(midi_path=None, preview=False, choose=False, use_test_default=True, difficulty="Normal",
+              render_mode=None, playback=None, start_offset=0.0):
     """
     単体デバッグ起動：
       優先順位 1) midi_path 2) choose 3) TEST_MIDI_PATH 4) 自動生成
@@ -503,7 +971,9 @@ def debug_run(midi_path=None, preview=False, choose=False, use_test_default=True
         print(f"[INFO] Using generated test MIDI (not found: {path!r})")
         path = _debug_generate_midi()
 
-    game = MidiGame(path, preview_mode=preview, difficulty=difficulty)
+    game = MidiGame(path, preview_mode=preview, difficulty=difficulty, render_mode=render_mode,
+                    playback=playback, autostart=False)
+    game.start(offset=start_offset)
     return app.exec_()
 
 if __name__ == "__main__":
@@ -514,12 +984,30 @@ if __name__ == "__main__":
     parser.add_argument("--choose", action="store_true", help="Open file chooser.")
     parser.add_argument("--no-test", action="store_true", help="Do NOT use TEST_MIDI_PATH by default.")
     parser.add_argument("--difficulty", choices=["Easy","Normal","Hard"], default="Normal")
+    parser.add_argument("--render", choices=RENDER_MODES, default=None,
+                        help="Renderer (default: $BREAKGATE_RENDER or 'scene').")
+    parser.add_argument("--playback", choices=PLAYBACK_MODES, default=None,
+                        help="MIDI playback (default: $BREAKGATE_PLAYBACK or 'thread').")
+    parser.add_argument("--start", type=float, default=0.0, metavar="SEC",
+                        help="Start from this position in the song (seconds).")
+    parser.add_argument("--precompile", nargs="+", metavar="ROOT",
+                        help="Compile charts for all songs under these music roots into the cache and exit "
+                             "(same as: python midi_chart.py ROOT ...).")
     args = parser.parse_args()
 
+    if args.precompile:
+        # ワーカーは spawn で __main__ を読み直すので、Qt を読まない midi_chart を入口にして別プロセスで走らせる
+        import subprocess
+        sys.exit(subprocess.call([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                               "midi_chart.py"), *args.precompile]))
+
     sys.exit(debug_run(
         midi_path=args.midi,
         preview=args.preview,
         choose=args.choose,
         use_test_default=not args.no_test,
-        difficulty=args.difficulty
+        difficulty=args.difficulty,
+        render_mode=args.render,
+        playback=args.playback,
+        start_offset=args.start
     ))
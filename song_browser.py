@@ -0,0 +1,819 @@
+# song_browser.py
+# 選曲ダイアログの曲一覧（ライブラリ索引の情報を列で表示）
+import os
+import time
+import queue
+import array
+import threading
+import unicodedata
+
+import numpy as np
+from PyQt5.QtWidgets import QTreeView, QHeaderView, QAbstractItemView, QStyledItemDelegate, QStyle
+from PyQt5.QtGui import QPixmap, QPixmapCache, QPainter, QColor
+from PyQt5.QtCore import (
+    Qt, QObject, QThread, QTimer, QSize, QFileSystemWatcher, QAbstractTableModel, QModelIndex, pyqtSignal,
+)
+
+from song_library import song_library, format_duration, file_signature, scan_dir, DIFFICULTIES
+
+SONG_COLUMNS = ("曲", "分布", "長さ", "BPM", "ノーツ", "密度 E/N/H", "トラック")
+COL_TITLE, COL_STRIP, COL_DURATION, COL_BPM, COL_NOTES, COL_DENSITY, COL_TRACKS = range(len(SONG_COLUMNS))
+_PATH_ROLE = Qt.UserRole
+_STRIP_ROLE = Qt.UserRole + 1
+
+STRIP_SIZE = (120, 14)     # ノーツ分布のサムネイル（px）
+STRIP_MARK_SEC = 45.0      # サムネイルに線を引く位置（休憩1回ぶんの目安）
+
+SCAN_POLL_SEC = 30.0       # QFileSystemWatcher が使えないフォルダを見直す間隔
+SCAN_BATCH_SEC = 0.1       # 走査中、見つけたファイルをまとめて流す間隔
+SEARCH_REFRESH_MS = 150    # 検索中に曲情報が届いたら、まとめて絞り込み直すまでの間
+
+
+class _LibraryIndexThread(QThread):
+    """
+    未索引の曲をワーカープロセスで解析する（1件できるたびに indexed を出す）。
+    走っている間に add() されたぶんは、今の解析が終わったあとにまとめて解析する。
+    """
+    indexed = pyqtSignal(object)   # SongInfo
+
+    def __init__(self, paths, parent=None):
+        super().__init__(parent)
+        self._lock = threading.Lock()
+        self._pending = list(paths)
+        self._closed = False
+        self._cancel = threading.Event()
+
+    def add(self, paths):
+        """解析待ちに足す。もう終わるところなら False（新しいスレッドで解析すること）"""
+        with self._lock:
+            if self._closed or self._cancel.is_set():
+                return False
+            self._pending.extend(paths)
+            return True
+
+    def stop(self):
+        self._cancel.set()
+
+    def run(self):
+        while not self._cancel.is_set():
+            with self._lock:
+                paths, self._pending = list(dict.fromkeys(self._pending)), []
+                if not paths:
+                    self._closed = True
+                    return
+            try:
+                song_library().update(paths, on_result=self.indexed.emit, cancel=self._cancel)
+            except Exception:
+                pass
+
+
+_retired_threads = set()   # 止めた解析スレッド（終わるまで参照を持っておく）
+
+
+def _retire_thread(th):
+    """待たずに手放す。終わったら片付ける（GUI スレッドで wait しない）"""
+    _retired_threads.add(th)
+    th.finished.connect(lambda th=th: (_retired_threads.discard(th), th.deleteLater()))
+    if th.isFinished():
+        _retired_threads.discard(th)
+        th.deleteLater()
+
+
+# ====== フォルダの走査と監視 ======
+def _norm_root(path):
+    return os.path.abspath(path)
+
+
+def _path_key(path):
+    """比較・重複判定用（Windows では大文字小文字を区別しない）。表示や保存には使わない"""
+    return os.path.normcase(os.path.abspath(path))
+
+
+def _is_under(path, roots):
+    key = os.path.normcase(path)
+    return any(key.startswith(os.path.normcase(r) + os.sep) for r in roots)
+
+
+class _DirState:
+    __slots__ = ("mtime", "files", "subdirs")
+
+    def __init__(self, mtime, files, subdirs):
+        self.mtime = mtime
+        self.files = files
+        self.subdirs = subdirs
+
+
+class _ScanBatch:
+    """走査の結果をためて、SCAN_BATCH_SEC ごとにシグナルで流す"""
+    def __init__(self, scanner):
+        self.scanner = scanner
+        self.found = []
+        self.removed = []
+        self.watch = []
+        self.unwatch = []
+        self.recheck = False         # 監視を足したあとにもう一度読む（監視前に置かれたファイルを拾う）
+        self._last = time.monotonic()
+
+    def flush(self, force=False):
+        if not force and time.monotonic() - self._last < SCAN_BATCH_SEC:
+            return
+        self._last = time.monotonic()
+        sc = self.scanner
+        if self.found:
+            sc.found.emit(self.found); self.found = []
+        if self.removed:
+            sc.removed.emit(self.removed); self.removed = []
+        if self.watch or self.unwatch:
+            sc._watch.emit(self.watch, self.unwatch, self.recheck); self.watch = []; self.unwatch = []
+
+
+class SongScanner(QObject):
+    """
+    曲フォルダ（root）を再帰的に os.scandir で走査し、MIDI ファイルの一覧を持ち続ける。
+      start(roots)  : 未走査の root を裏スレッドで走査する（見つけたものから found で流す）
+      files(roots)  : 今の一覧 {path: (mtime_ns, size)}（ディスクには触らない）
+    走査後は QFileSystemWatcher でフォルダの変化を拾い、そのフォルダだけ読み直す。
+    監視できないフォルダがあれば SCAN_POLL_SEC ごとの mtime 比較に切り替える。
+    シグナルは走査スレッドから出る（受け側へはキュー経由で届く）。
+    """
+    found = pyqtSignal(object)       # [(path, (mtime_ns, size))]  新規・更新
+    removed = pyqtSignal(object)     # [path]
+    scanned = pyqtSignal(str)        # root の初回走査が終わった
+    _watch = pyqtSignal(object, object, bool)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._lock = threading.Lock()
+        self._files = {}             # path -> (mtime_ns, size)
+        self._dirs = {}              # 走査済みフォルダ -> _DirState
+        self._roots = {}             # _path_key(root) -> 初回走査済みの Event
+        self._root_paths = {}        # _path_key(root) -> root（最初に渡された綴りのまま）
+        self._queue = queue.Queue()
+        self._thread = None
+        self._polling = False
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(lambda d: self._queue.put(("dir", d)))
+        self._watch.connect(self._on_watch)
+
+    def start(self, roots):
+        """roots の走査を始める（走査済みなら何もしない）。正規化した root のリストを返す。"""
+        out = []
+        with self._lock:
+            for r in roots or []:
+                if not r:
+                    continue
+                k = _path_key(r)
+                r = self._root_paths.setdefault(k, _norm_root(r))
+                if r in out:
+                    continue
+                out.append(r)
+                if k not in self._roots:
+                    self._roots[k] = threading.Event()
+                    self._queue.put(("root", r))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="song-scanner", daemon=True)
+                self._thread.start()
+        return out
+
+    def files(self, roots=None, wait=None):
+        """roots 配下の一覧。wait 秒まで初回走査の終わりを待つ（None なら待たない）。"""
+        roots = [_norm_root(r) for r in roots] if roots is not None else None
+        if wait:
+            deadline = time.monotonic() + wait
+            for k in [_path_key(r) for r in roots] if roots is not None else list(self._roots):
+                ev = self._roots.get(k)
+                if ev is not None:
+                    ev.wait(max(0.0, deadline - time.monotonic()))
+        with self._lock:
+            if roots is None:
+                return dict(self._files)
+            return {p: sig for p, sig in self._files.items() if _is_under(p, roots)}
+
+    def is_scanned(self, root):
+        ev = self._roots.get(_path_key(root))
+        return ev is not None and ev.is_set()
+
+    def rescan(self):
+        """全フォルダの mtime を見直す（監視の取りこぼし対策）"""
+        self._queue.put(("poll", None))
+
+    # ====== 内部（走査スレッド） ======
+    def _run(self):
+        while True:
+            try:
+                kind, arg = self._queue.get(timeout=SCAN_POLL_SEC if self._polling else None)
+            except queue.Empty:
+                kind, arg = "poll", None
+            batch = _ScanBatch(self)
+            batch.recheck = kind != "root"
+            try:
+                if kind == "root":
+                    self._scan(arg, batch)
+                elif kind == "dir":
+                    self._scan(_norm_root(arg), batch)
+                elif kind == "poll":
+                    self._poll(batch)
+            except Exception:
+                pass
+            batch.flush(force=True)
+            if kind == "root":
+                self._roots[_path_key(arg)].set()
+                self.scanned.emit(arg)
+
+    def _scan(self, top, batch):
+        """top を読み直す。知らないサブフォルダは下まで辿る。"""
+        stack = [top]
+        while stack:
+            d = stack.pop()
+            res = scan_dir(d)
+            with self._lock:
+                old = self._dirs.get(d)
+            if res is None:
+                self._drop_dir(d, batch)
+                continue
+            files, subdirs, mtime = res
+            with self._lock:
+                for p, sig in files.items():
+                    if self._files.get(p) != sig:
+                        self._files[p] = sig
+                        batch.found.append((p, sig))
+                for p in (old.files if old else ()):
+                    if p not in files:
+                        self._files.pop(p, None)
+                        batch.removed.append(p)
+                self._dirs[d] = _DirState(mtime, set(files), set(subdirs))
+            if old is None:
+                batch.watch.append(d)
+            for sd in (old.subdirs if old else set()) - set(subdirs):
+                self._drop_dir(sd, batch)
+            with self._lock:
+                stack.extend(sd for sd in subdirs if sd not in self._dirs)
+            batch.flush()
+
+    def _drop_dir(self, d, batch):
+        """消えたフォルダ（と配下）を一覧から外す"""
+        with self._lock:
+            gone = [x for x in self._dirs if x == d or x.startswith(d + os.sep)]
+            for x in gone:
+                for p in self._dirs.pop(x).files:
+                    if self._files.pop(p, None) is not None:
+                        batch.removed.append(p)
+        batch.unwatch.extend(gone)
+
+    def _poll(self, batch):
+        with self._lock:
+            dirs = {d: st.mtime for d, st in self._dirs.items()}
+            files = dict(self._files)
+        for d, mtime in dirs.items():
+            try:
+                changed = os.stat(d).st_mtime_ns != mtime
+            except OSError:
+                changed = True
+            if changed:
+                self._scan(d, batch)
+        # 上書き保存はフォルダの mtime を変えないことがあるので、ファイルも見る
+        for p, sig in files.items():
+            cur = file_signature(p)
+            if cur is not None and cur != sig:
+                with self._lock:
+                    if p in self._files:
+                        self._files[p] = cur
+                        batch.found.append((p, cur))
+            batch.flush()
+
+    # ====== 内部（GUI スレッド） ======
+    def _on_watch(self, add, remove, recheck):
+        if remove:
+            self._watcher.removePaths(remove)
+        if add:
+            failed = self._watcher.addPaths(add)
+            if recheck:
+                for d in add:
+                    self._queue.put(("dir", d))
+            if failed and not self._polling:
+                self._polling = True
+                self._queue.put(("poll", None))   # 待ちを SCAN_POLL_SEC 付きに切り替える
+
+
+_scanner = None
+
+
+def song_scanner() -> SongScanner:
+    """プロセスで1つの走査器（GUI スレッドで最初に呼ぶこと）"""
+    global _scanner
+    if _scanner is None:
+        _scanner = SongScanner()
+    return _scanner
+
+
+def _bpm_text(info):
+    if info.bpm_min is None:
+        return ""
+    if abs(info.bpm_max - info.bpm_min) < 0.5:
+        return f"{info.bpm_min:.0f}"
+    return f"{info.bpm_min:.0f}–{info.bpm_max:.0f}"
+
+
+def song_row_texts(info):
+    """SongInfo → 長さ以降の列の表示文字列"""
+    if info.error:
+        return ("", "", "", "読めません", "")
+    density = "/".join(f"{info.density.get(d, 0):.1f}" for d in DIFFICULTIES)
+    return (format_duration(info.duration), _bpm_text(info), str(info.notes or 0), density,
+            ", ".join(info.tracks))
+
+
+# ====== 一覧のモデル ======
+def _search_key(text):
+    return unicodedata.normalize("NFKC", text).lower()
+
+
+def _bigrams(text):
+    """隣り合う2文字と、1文字とばしの2文字（入れ替わり・1文字違いに強くする）"""
+    grams = {text[k:k + 2] for k in range(len(text) - 1)}
+    grams.update(text[k] + text[k + 2] for k in range(len(text) - 2))
+    return grams
+
+
+class SongListModel(QAbstractTableModel):
+    """
+    曲一覧のモデル。行は持たず、曲 id（追加順）の配列 _rows を並べ替え・絞り込みで作り直すだけ。
+    表示文字列は見えている行のぶんだけ data() で作る。
+    検索は曲名・フォルダ名・トラック名・BPM の2文字組（bigram）の転置索引で行い、
+    語ごとに 2文字組の 2/3 以上が合えば一致とみなす（打ち間違い・入れ替わり・抜けを許す）。
+    語の結果はキャッシュするので、打鍵ごとに計算し直すのは入力中の語だけ。
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._paths = []
+        self._titles = []
+        self._infos = []
+        self._keys = []              # 検索用の文字列（小文字・NFKC）
+        self._grams = []             # id -> そのキーの bigram 集合
+        self._alive = bytearray()    # id -> 一覧に載っているか（削除されたら 0）
+        self._postings = {}          # bigram -> array('i') of id
+        self._id_of = {}             # _path_key(path) -> id
+        self._rows = np.zeros(0, np.int64)
+        self._row_of = None          # id -> 行（必要になったら作る）
+        self._query = []
+        self._term_cache = {}
+        self._sort_column = -1
+        self._sort_order = Qt.AscendingOrder
+        self._difficulty = "Normal"
+        self._refresh = QTimer(self)
+        self._refresh.setSingleShot(True)
+        self._refresh.setInterval(SEARCH_REFRESH_MS)
+        self._refresh.timeout.connect(self._apply)
+        self._pending = []           # まだ転置索引に入れていない (id, 文字列)
+        self._index_timer = QTimer(self)
+        self._index_timer.setSingleShot(True)
+        self._index_timer.timeout.connect(lambda: self._flush_index(200))   # 1回 10ms 前後
+
+    # ====== Qt のモデル ======
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(SONG_COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole and 0 <= section < len(SONG_COLUMNS):
+            return SONG_COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+        i = int(self._rows[index.row()])
+        col = index.column()
+        if role == Qt.DisplayRole:
+            if col == COL_TITLE:
+                return self._titles[i]
+            info = self._infos[i]
+            if col == COL_STRIP or info is None:
+                return ""
+            return song_row_texts(info)[col - COL_DURATION]
+        if role == _PATH_ROLE:
+            return self._paths[i]
+        if role == _STRIP_ROLE:
+            return self._infos[i]
+        if role == Qt.ToolTipRole and col == COL_TITLE:
+            info = self._infos[i]
+            return f"{self._paths[i]}\n{info.error}" if info is not None and info.error else self._paths[i]
+        if role == Qt.TextAlignmentRole and COL_DURATION <= col <= COL_DENSITY:
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self._sort_column = column
+        self._sort_order = order
+        self._apply()
+
+    # ====== 曲の出し入れ ======
+    def path_at(self, row):
+        return self._paths[int(self._rows[row])] if 0 <= row < len(self._rows) else None
+
+    def row_of(self, path):
+        i = self._id_of.get(_path_key(path))
+        if i is None:
+            return -1
+        if self._row_of is None:
+            self._row_of = np.full(len(self._paths), -1, np.int64)
+            self._row_of[self._rows] = np.arange(len(self._rows))
+        return int(self._row_of[i]) if i < len(self._row_of) else -1
+
+    def add_paths(self, paths):
+        """載っていないパスを足す。足したものを返す。"""
+        added = []
+        for p in paths:
+            k = _path_key(p)
+            i = self._id_of.get(k)
+            if i is not None:
+                if not self._alive[i]:
+                    self._alive[i] = 1
+                    added.append(p)
+                continue
+            i = len(self._paths)
+            self._id_of[k] = i
+            title = os.path.splitext(os.path.basename(p))[0]
+            self._paths.append(p)
+            self._titles.append(title)
+            self._infos.append(None)
+            self._keys.append("")
+            self._grams.append(set())
+            self._alive.append(1)
+            self._index_text(i, f"{title} {os.path.basename(os.path.dirname(p))}")
+            added.append(p)
+        if added:
+            self._term_cache.clear()
+            self._apply()
+        return added
+
+    def remove_paths(self, paths):
+        hit = False
+        for p in paths:
+            i = self._id_of.get(_path_key(p))
+            if i is not None and self._alive[i]:
+                self._alive[i] = 0
+                hit = True
+        if hit:
+            self._apply()
+
+    def set_info(self, info):
+        i = self._id_of.get(_path_key(info.path))
+        if i is None:
+            return
+        self._infos[i] = info
+        extra = " ".join(info.tracks or ())
+        if info.bpm_min is not None:
+            extra += f" {info.bpm_min:.0f} {info.bpm_max:.0f}"
+        if extra:
+            self._index_text(i, extra)
+        if self._query or self._sort_column > COL_STRIP:
+            self._term_cache.clear()
+            self._refresh.start()      # 絞り込み・並び順が変わりうるので、まとめてやり直す
+            return
+        row = self.row_of(info.path)
+        if row >= 0:
+            self.dataChanged.emit(self.index(row, COL_STRIP), self.index(row, len(SONG_COLUMNS) - 1))
+
+    # ====== 検索と並べ替え ======
+    def set_query(self, text):
+        query = _search_key(text or "").split()
+        if query != self._query:
+            self._query = query
+            self._apply()
+
+    def set_difficulty(self, difficulty):
+        """密度の列で並べるときの難易度"""
+        self._difficulty = difficulty
+        if self._sort_column == COL_DENSITY:
+            self._apply()
+
+    def _index_text(self, i, text):
+        text = _search_key(text)
+        self._keys[i] = f"{self._keys[i]} {text}" if self._keys[i] else text
+        self._pending.append((i, text))     # 転置索引へは暇なときに（最初の検索までには必ず）入れる
+        if not self._index_timer.isActive():
+            self._index_timer.start()
+
+    def _flush_index(self, limit=None):
+        pending = self._pending
+        n = len(pending) if limit is None else min(limit, len(pending))
+        if not n:
+            return
+        for i, text in pending[:n]:
+            grams = self._grams[i]
+            for g in _bigrams(text) - grams:
+                grams.add(g)
+                post = self._postings.get(g)
+                if post is None:
+                    post = self._postings[g] = array.array("i")
+                post.append(i)
+        del pending[:n]
+        self._term_cache.clear()
+        if pending:
+            self._index_timer.start()
+
+    def _term_scores(self, term):
+        """語 term に対する id ごとの一致度（0 = 不一致）。"""
+        self._flush_index()
+        cached = self._term_cache.get(term)
+        if cached is not None:
+            return cached
+        n_ids = len(self._paths)
+        if len(term) == 1:
+            scores = np.fromiter((term in k for k in self._keys), np.float32, n_ids)
+        else:
+            grams = _bigrams(term)
+            counts = np.zeros(n_ids, np.int32)
+            for g in grams:
+                post = self._postings.get(g)
+                if post:
+                    counts += np.bincount(np.frombuffer(post, np.int32), minlength=n_ids).astype(np.int32)
+            need = len(grams) - len(grams) // 3
+            scores = counts.astype(np.float32) / len(grams)
+            scores[counts < need] = 0
+        if len(self._term_cache) > 64:
+            self._term_cache.clear()
+        self._term_cache[term] = scores
+        return scores
+
+    def _sort_keys(self, ids):
+        col = self._sort_column
+        if col == COL_DURATION:
+            vals = [self._infos[i].duration if self._infos[i] else None for i in ids]
+        elif col == COL_BPM:
+            vals = [self._infos[i].bpm_max if self._infos[i] else None for i in ids]
+        elif col == COL_NOTES:
+            vals = [self._infos[i].notes if self._infos[i] else None for i in ids]
+        elif col == COL_DENSITY:
+            vals = [self._infos[i].density.get(self._difficulty) if self._infos[i] else None for i in ids]
+        else:
+            vals = [len(self._infos[i].tracks) if self._infos[i] else None for i in ids]
+        return np.array([np.nan if v is None else v for v in vals], np.float64)
+
+    def _apply(self):
+        """絞り込み・並べ替えをやり直す（ビューの選択は SongTable が戻す）"""
+        self._refresh.stop()
+        n_ids = len(self._paths)
+        mask = np.frombuffer(bytes(self._alive), np.uint8).astype(bool) if n_ids else np.zeros(0, bool)
+        score = None
+        for term in self._query:
+            s = self._term_scores(term)
+            score = s.copy() if score is None else score + s
+            mask &= s > 0
+        ids = np.flatnonzero(mask)
+        col = self._sort_column
+        if col == COL_TITLE:
+            order = sorted(range(len(ids)), key=lambda k: self._titles[ids[k]].lower())
+            ids = ids[np.array(order, np.int64)] if len(ids) else ids
+            if self._sort_order == Qt.DescendingOrder:
+                ids = ids[::-1]
+        elif col > COL_STRIP:
+            keys = self._sort_keys(ids)
+            if self._sort_order == Qt.DescendingOrder:
+                keys = -keys
+            ids = ids[np.argsort(keys, kind="stable")]   # 未解析（NaN）はどちら向きでも末尾
+        elif score is not None:
+            ids = ids[np.argsort(-score[ids], kind="stable")]
+        self.beginResetModel()
+        self._rows = ids
+        self._row_of = None
+        self.endResetModel()
+
+
+# ====== ノーツ分布のサムネイル ======
+def render_density_strip(info, width, height, color=None):
+    """
+    SongInfo.histogram（曲の長さを等分した区間ごとの発音数）を棒の列で描いた QPixmap。
+    STRIP_MARK_SEC の位置に縦線を引く。
+    """
+    pm = QPixmap(width, height)
+    pm.fill(Qt.transparent)
+    hist = info.histogram or []
+    peak = max(hist) if hist else 0
+    if not peak:
+        return pm
+    p = QPainter(pm)
+    try:
+        color = QColor(color or "#3a7bd5")
+        n = len(hist)
+        for k, c in enumerate(hist):
+            if not c:
+                continue
+            x0 = k * width // n
+            x1 = max(x0 + 1, (k + 1) * width // n)
+            h = max(1, round(height * c / peak))
+            p.fillRect(x0, height - h, x1 - x0, h, color)
+        if info.duration and info.duration > STRIP_MARK_SEC:
+            x = int(width * STRIP_MARK_SEC / info.duration)
+            p.fillRect(x, 0, 1, height, QColor(220, 60, 60, 200))
+    finally:
+        p.end()
+    return pm
+
+
+class DensityStripDelegate(QStyledItemDelegate):
+    """
+    分布の列。描くのは見えている行だけで、描いた絵は QPixmapCache に入れて使い回す
+    （キーはパス＋更新時刻＋大きさ。ファイルが変われば別の絵になる）。
+    """
+    def paint(self, painter, option, index):
+        QStyledItemDelegate.paint(self, painter, option, index)   # 選択の背景など
+        info = index.data(_STRIP_ROLE)
+        if info is None or info.error or not info.histogram:
+            return
+        w = min(STRIP_SIZE[0], option.rect.width() - 4)
+        h = min(STRIP_SIZE[1], option.rect.height() - 4)
+        if w <= 0 or h <= 0:
+            return
+        selected = bool(option.state & QStyle.State_Selected)
+        color = option.palette.highlightedText().color().name() if selected else None
+        key = f"breakgate-strip:{info.path}:{info.mtime_ns}:{info.size}:{w}x{h}:{color}"
+        pm = QPixmapCache.find(key)
+        if pm is None:
+            pm = render_density_strip(info, w, h, color)
+            QPixmapCache.insert(key, pm)
+        r = option.rect
+        painter.drawPixmap(r.x() + (r.width() - w) // 2, r.y() + (r.height() - h) // 2, pm)
+
+    def sizeHint(self, option, index):
+        return QSize(STRIP_SIZE[0] + 8, STRIP_SIZE[1] + 4)
+
+
+# ====== 一覧のビュー ======
+class SongTable(QTreeView):
+    """
+    曲の一覧（SongListModel のビュー）。行のウィジェットは作らず、見えている行だけ描く。
+    長さ・BPM などはライブラリ索引から読み、無いものだけバックグラウンドで解析して後から埋める。
+    set_filter で絞り込み、見出しのクリックで並べ替え。
+    """
+    songActivated = pyqtSignal(str)
+    currentPathChanged = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._model = SongListModel(self)
+        self.setModel(self._model)
+        self.selectionModel().currentRowChanged.connect(self._on_current_changed)
+        self.setRootIsDecorated(False)
+        self.setUniformRowHeights(True)
+        self.setAllColumnsShowFocus(True)
+        self.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.setSelectionBehavior(QAbstractItemView.SelectRows)
+        header = self.header()
+        header.setStretchLastSection(True)    # トラック名の列が残りの幅を使う
+        fm = self.fontMetrics()
+        header.setSectionResizeMode(COL_TITLE, QHeaderView.Interactive)
+        self.setColumnWidth(COL_TITLE, fm.horizontalAdvance("曲名曲名曲名曲名曲名曲名") + 24)
+        samples = {COL_DURATION: "00:00", COL_BPM: "000–000", COL_NOTES: "00000",
+                   COL_DENSITY: "00.0/00.0/00.0", COL_TRACKS: "トラック名トラック名"}
+        for c, sample in samples.items():
+            header.setSectionResizeMode(c, QHeaderView.Interactive)   # ResizeToContents は行数に比例して重い
+            self.setColumnWidth(c, max(fm.horizontalAdvance(sample), fm.horizontalAdvance(SONG_COLUMNS[c])) + 24)
+        header.setSectionResizeMode(COL_STRIP, QHeaderView.Fixed)
+        self.setColumnWidth(COL_STRIP, STRIP_SIZE[0] + 8)
+        self.setItemDelegateForColumn(COL_STRIP, DensityStripDelegate(self))
+        self.setSortingEnabled(True)
+        self.sortByColumn(-1, Qt.AscendingOrder)   # 最初は追加順
+        self._keep_path = None
+        self._model.modelAboutToBeReset.connect(self._remember_current)
+        self._model.modelReset.connect(self._restore_current)
+        self._index_thread = None
+        self._scanner = None
+        self._roots = []
+        self.doubleClicked.connect(lambda idx: self.songActivated.emit(self._model.path_at(idx.row())))
+
+    def count(self):
+        """表示中（絞り込み後）の行数"""
+        return self._model.rowCount()
+
+    def set_filter(self, text):
+        self._model.set_query(text)
+
+    def set_difficulty(self, difficulty):
+        self._model.set_difficulty(difficulty)
+
+    def follow(self, roots, scanner=None):
+        """
+        roots 配下の曲を一覧に出し、以後は走査器の追加・削除に追従する。
+        走査済みならディスクには触らず、まだなら見つかったものから順に並ぶ。
+        """
+        scanner = scanner or song_scanner()
+        if self._scanner is None:
+            scanner.found.connect(self._on_found)
+            scanner.removed.connect(self.remove_paths)
+            self._scanner = scanner
+        self._roots = list(dict.fromkeys(self._roots + scanner.start(roots)))
+        files = scanner.files(self._roots)
+        self.add_paths(list(files), files)
+
+    def add_paths(self, paths, signatures=None):
+        """
+        まだ無いパスを追加する。索引済みの情報はその場で、残りは解析が終わりしだい表示する。
+        signatures（{path: (mtime_ns, size)}）を渡すと既存の行も照合し直す（更新されたファイル）。
+        """
+        paths = [p for p in paths if p]
+        new = self._model.add_paths(paths)
+        if new and not self.current_path():
+            self.set_current_row(0)
+        check = paths if signatures else new
+        if not check:
+            return
+        known = song_library().lookup(check, signatures)
+        for info in known.values():
+            self._model.set_info(info)
+        stale = [p for p in check if p not in known]
+        if stale:
+            self._start_indexing(stale)
+
+    def add_path(self, path):
+        self.add_paths([path])
+
+    def remove_paths(self, paths):
+        self._model.remove_paths(paths)
+
+    def set_info(self, info):
+        self._model.set_info(info)
+
+    def current_path(self):
+        idx = self.currentIndex()
+        return self._model.path_at(idx.row()) if idx.isValid() else None
+
+    def neighbor_paths(self, count):
+        """選択中の行の前後 count 行ぶんのパス（近い順）"""
+        row = self.currentIndex().row()
+        out = []
+        for d in range(1, count + 1):
+            for r in (row + d, row - d):
+                p = self._model.path_at(r)
+                if p:
+                    out.append(p)
+        return out
+
+    def set_current_path(self, path):
+        row = self._model.row_of(path)
+        if row >= 0:
+            self.set_current_row(row)
+
+    def set_current_row(self, row):
+        if 0 <= row < self._model.rowCount():
+            idx = self._model.index(row, 0)
+            self.setCurrentIndex(idx)
+            self.scrollTo(idx)
+
+    def stop_indexing(self):
+        """裏の解析を止め、走査器への追従もやめる（ダイアログを閉じるとき）"""
+        scanner, self._scanner = self._scanner, None
+        if scanner is not None:
+            try:
+                scanner.found.disconnect(self._on_found)
+                scanner.removed.disconnect(self.remove_paths)
+            except Exception:
+                pass
+        self._stop_index_thread()
+
+    def _stop_index_thread(self):
+        th, self._index_thread = self._index_thread, None
+        if th is not None:
+            th.stop()
+            try:
+                th.indexed.disconnect(self.set_info)
+            except Exception:
+                pass
+            _retire_thread(th)
+
+    def _on_current_changed(self, current, _previous):
+        path = self._model.path_at(current.row()) if current.isValid() else None
+        if path:
+            self.currentPathChanged.emit(path)
+
+    def _remember_current(self):
+        self._keep_path = self.current_path()
+
+    def _restore_current(self):
+        path, self._keep_path = self._keep_path, None
+        row = self._model.row_of(path) if path else -1
+        if row < 0 and self._model.rowCount():
+            row = 0
+        if row >= 0:
+            self.setCurrentIndex(self._model.index(row, 0))
+
+    def _on_found(self, entries):
+        entries = [(p, sig) for p, sig in entries if _is_under(p, self._roots)]
+        if entries:
+            self.add_paths([p for p, _ in entries], dict(entries))
+
+    def _start_indexing(self, paths):
+        prev = self._index_thread
+        if prev is not None and prev.add(paths):
+            return                           # 走っている解析に足す（ワーカーは作り直さない）
+        if prev is not None:
+            self._index_thread = None
+            _retire_thread(prev)
+        # 親は付けない（ダイアログが閉じても解析中のスレッドごと消されないように）
+        th = _LibraryIndexThread(paths)
+        th.indexed.connect(self.set_info)
+        self._index_thread = th
+        th.start()
@@ -0,0 +1,265 @@
+# song_library.py
+# 曲ライブラリの索引（長さ・ノーツ数・テンポ・難易度ごとの密度・トラック名）を SQLite に保存する
+# Qt には依存しない（解析はワーカープロセスで行う）
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import multiprocessing
+
+LIBRARY_DB = os.environ.get("BREAKGATE_LIBRARY_DB") or os.path.join(
+    os.path.expanduser("~"), ".breakgate", "library.sqlite3"
+)
+LIBRARY_VERSION = 2          # 列や解析内容を変えたら上げる（古い行は読み直す）
+MIDI_EXTS = (".mid", ".midi")
+DIFFICULTIES = ("Easy", "Normal", "Hard")
+HISTOGRAM_BINS = 48          # ノーツ分布（曲の長さを何区間に分けて数えるか）
+
+SongInfo = namedtuple("SongInfo", [
+    "path", "mtime_ns", "size",
+    "duration",      # 秒
+    "notes",         # 発音数（velocity>0 の note_on）
+    "bpm_min", "bpm_max",
+    "density",       # {難易度: 譜面のノーツ数/秒}
+    "tracks",        # トラック名のリスト
+    "histogram",     # 曲の長さを HISTOGRAM_BINS 等分した区間ごとの発音数
+    "error",         # 解析に失敗したときのメッセージ（成功なら None）
+])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    path       TEXT PRIMARY KEY,
+    mtime_ns   INTEGER NOT NULL,
+    size       INTEGER NOT NULL,
+    duration   REAL,
+    notes      INTEGER,
+    bpm_min    REAL,
+    bpm_max    REAL,
+    density    TEXT,
+    tracks     TEXT,
+    histogram  TEXT,
+    error      TEXT,
+    indexed_at REAL
+)
+"""
+
+
+def file_signature(path):
+    """(mtime_ns, size)。無ければ None。"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def scan_dir(path):
+    """
+    1ディレクトリぶんの走査（os.scandir）。(MIDI ファイル {path: (mtime_ns, size)}, サブフォルダ [path], mtime_ns)。
+    隠しフォルダと __pycache__ は辿らない。読めなければ None。
+    """
+    files, subdirs = {}, []
+    try:
+        with os.scandir(path) as it:
+            for e in it:
+                try:
+                    if e.is_dir(follow_symlinks=False):
+                        if not e.name.startswith(".") and e.name != "__pycache__":
+                            subdirs.append(e.path)
+                    elif e.name.lower().endswith(MIDI_EXTS) and e.is_file():
+                        st = e.stat()
+                        files[e.path] = (st.st_mtime_ns, st.st_size)
+                except OSError:
+                    pass
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    return files, subdirs, mtime
+
+
+# ====== 解析（ワーカープロセスで実行） ======
+def analyze_midi(path):
+    """1曲ぶんの SongInfo を作る。失敗しても例外は出さず error に入れて返す。"""
+    sig = file_signature(path) or (0, 0)
+    try:
+        import mido
+        import numpy as np
+        from midi_song import MidiSong
+        from midi_chart import compile_chart
+
+        midi = mido.MidiFile(path)
+        song = MidiSong(path, midi=midi)
+        note_times = song.note_on_times()
+        tempos = song.tempo_map.tempo
+        duration = float(song.length)
+        density = {}
+        for diff in DIFFICULTIES:
+            times, _ = compile_chart(note_times, diff, seed=0)   # 密度はシードに依らない
+            density[diff] = round(len(times) / duration, 3) if duration > 0 else 0.0
+        tracks = [_track_name(t.name) for t in midi.tracks if getattr(t, "name", "")]
+        hist = np.histogram(note_times, bins=HISTOGRAM_BINS, range=(0.0, max(duration, 1e-6)))[0]
+        return SongInfo(path, sig[0], sig[1], duration, int(len(note_times)),
+                        round(60e6 / max(tempos), 2), round(60e6 / min(tempos), 2),
+                        density, tracks, hist.tolist(), None)
+    except Exception as ex:
+        return SongInfo(path, sig[0], sig[1], None, None, None, None, {}, [], [], str(ex) or type(ex).__name__)
+
+
+def _track_name(raw):
+    """mido は meta の文字列を latin-1 で読むので、UTF-8 / Shift_JIS として読み直す"""
+    try:
+        data = raw.encode("latin-1")
+    except UnicodeEncodeError:
+        return raw
+    for enc in ("utf-8", "cp932"):
+        try:
+            return data.decode(enc)
+        except UnicodeDecodeError:
+            pass
+    return raw
+
+
+def _row_to_info(row):
+    path, mtime_ns, size, duration, notes, bpm_min, bpm_max, density, tracks, histogram, error = row
+    return SongInfo(path, mtime_ns, size, duration, notes, bpm_min, bpm_max,
+                    json.loads(density or "{}"), json.loads(tracks or "[]"), json.loads(histogram or "[]"), error)
+
+
+# ====== 索引 ======
+class SongLibrary:
+    """
+    path + mtime + size をキーにした曲情報のキャッシュ。
+      lookup(paths)  : 索引済みで、ファイルが変わっていないものだけを返す（ファイルは開かない）
+      stale(paths)   : 未索引・更新されたもの
+      update(paths)  : stale なものをワーカープロセスで並列に解析して保存
+    接続はスレッドごとに持つので、どのスレッドから呼んでもよい。
+    """
+    def __init__(self, db_path=None):
+        self.db_path = db_path or LIBRARY_DB
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != LIBRARY_VERSION:
+                conn.execute("DROP TABLE IF EXISTS songs")
+                conn.execute(f"PRAGMA user_version={LIBRARY_VERSION}")
+            conn.execute(_SCHEMA)
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def lookup(self, paths, signatures=None):
+        """
+        {path: SongInfo}。ファイルの mtime / size が保存時と同じものだけ。
+        signatures（{path: (mtime_ns, size)}）を渡すと stat を省く。
+        """
+        paths = list(paths)
+        out = {}
+        conn = self._conn()
+        for k in range(0, len(paths), 500):
+            chunk = paths[k:k + 500]
+            q = ",".join("?" * len(chunk))
+            rows = conn.execute(
+                "SELECT path, mtime_ns, size, duration, notes, bpm_min, bpm_max, density, tracks, histogram, error "
+                f"FROM songs WHERE path IN ({q})", chunk).fetchall()
+            for row in rows:
+                info = _row_to_info(row)
+                sig = signatures.get(info.path) if signatures else file_signature(info.path)
+                if sig == (info.mtime_ns, info.size):
+                    out[info.path] = info
+        return out
+
+    def stale(self, paths, signatures=None):
+        paths = list(paths)
+        known = self.lookup(paths, signatures)
+        return [p for p in paths if p not in known]
+
+    def store(self, infos):
+        rows = [(i.path, i.mtime_ns, i.size, i.duration, i.notes, i.bpm_min, i.bpm_max,
+                 json.dumps(i.density), json.dumps(i.tracks, ensure_ascii=False), json.dumps(i.histogram),
+                 i.error, time.time())
+                for i in infos]
+        if not rows:
+            return
+        with self._write_lock:
+            conn = self._conn()
+            conn.executemany("INSERT OR REPLACE INTO songs VALUES (?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+            conn.commit()
+
+    def forget(self, paths):
+        with self._write_lock:
+            conn = self._conn()
+            conn.executemany("DELETE FROM songs WHERE path = ?", [(p,) for p in paths])
+            conn.commit()
+
+    def update(self, paths, workers=None, on_result=None, cancel=None, signatures=None):
+        """
+        未索引・更新された曲を解析して保存する。結果が出るたびに on_result(SongInfo) を呼ぶ。
+        cancel（threading.Event）が立ったら残りは捨てる。戻り値は解析した件数。
+        """
+        todo = self.stale(paths, signatures)
+        if not todo:
+            return 0
+        done = 0
+        if len(todo) == 1 or workers == 1:
+            results = (analyze_midi(p) for p in todo)
+            for info in results:
+                if cancel is not None and cancel.is_set():
+                    break
+                self.store([info])
+                done += 1
+                if on_result:
+                    on_result(info)
+            return done
+        # spawn：Qt のスレッドを抱えた親を fork しない（ワーカーは親の __main__ を読み直すが、解析では Qt を使わない）
+        ctx = multiprocessing.get_context("spawn")
+        workers = workers or max(1, min(len(todo), (os.cpu_count() or 2) - 1))
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=ctx)
+        futures = [pool.submit(analyze_midi, p) for p in todo]
+        batch = []
+        try:
+            for fut in as_completed(futures):
+                if cancel is not None and cancel.is_set():
+                    break
+                info = fut.result()
+                batch.append(info)
+                done += 1
+                if on_result:
+                    on_result(info)
+                if len(batch) >= 32:
+                    self.store(batch)
+                    batch = []
+        finally:
+            self.store(batch)
+            # 取り消し時は解析中のワーカーを待たない
+            pool.shutdown(wait=not (cancel is not None and cancel.is_set()), cancel_futures=True)
+        return done
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def song_library() -> SongLibrary:
+    """プロセスで1つのライブラリ索引"""
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = SongLibrary()
+        return _library
+
+
+def format_duration(seconds):
+    if seconds is None:
+        return ""
+    seconds = int(round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02}"
@@ -0,0 +1,212 @@
+# song_preview.py
+# 選曲ダイアログの試聴：曲頭の数秒ぶんのイベントを切り出してキャッシュし、開いたままの出力で鳴らす
+# Qt には依存しない（コールバックは読み込みスレッドから呼ばれる）
+import time
+import threading
+from bisect import bisect_right
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from midi_song import MidiSong, EventBuffer, load_song
+from midi_player import MidiPlayer
+from song_library import file_signature
+
+PREVIEW_SEC = 8.0            # 試聴の長さ（最初の発音から）
+PREVIEW_CACHE_SIZE = 32      # 切り出しを保持する曲数
+PREFETCH_NEIGHBORS = 2       # 選択中の曲の前後何曲ぶんを先読みするか
+_LEAD_SEC = 0.1              # 最初の発音の少し前から鳴らす
+_CUTOVER_SEC = 0.005         # 切り替え時、前の曲の All Notes Off と次の曲の頭が重ならないための間
+
+# 切り出しの終わりに置く All Notes Off（途中で切れた音を止める）
+_NOTES_OFF = np.array([[0xB0 | ch, 123, 0] for ch in range(16)], np.uint8)
+
+
+class PreviewSlice:
+    """試聴1曲ぶん。MidiPlayer にそのまま渡せる（.buffer を持つ）。"""
+    def __init__(self, path, signature, buffer, offset):
+        self.path = path
+        self.signature = signature
+        self.buffer = buffer
+        self.offset = offset        # 再生を始める位置（曲頭の無音を飛ばす）
+
+
+def extract_preview(song, seconds=PREVIEW_SEC):
+    """MidiSong の先頭 seconds 秒（最初の発音から）を切り出す。"""
+    buf = song.buffer
+    onsets = np.flatnonzero(buf.note_on_mask())
+    first = float(buf.times[onsets[0]]) if len(onsets) else 0.0
+    offset = max(0.0, first - _LEAD_SEC)
+    end = offset + seconds
+    k = bisect_right(buf.time_list, end)
+    times = np.concatenate([buf.times[:k], np.full(len(_NOTES_OFF), end)])
+    data = np.concatenate([buf.data[:k], _NOTES_OFF])
+    return PreviewSlice(song.path, file_signature(song.path), EventBuffer(times, data), offset)
+
+
+class PreviewCache:
+    """
+    試聴の切り出しの LRU キャッシュ。読み込みは裏スレッド1本で行う。
+      request(path, cb) : すぐ鳴らしたい曲（先読みより先に読む）。できたら cb(slice)
+      prefetch(paths)   : 先読み。前回の先読み依頼のうち未着手のものは捨てる
+    ファイルが更新されていたら読み直す。
+    """
+    def __init__(self, size=PREVIEW_CACHE_SIZE, seconds=PREVIEW_SEC):
+        self.size = size
+        self.seconds = seconds
+        self._cache = OrderedDict()          # path -> PreviewSlice
+        self._cond = threading.Condition()
+        self._urgent = deque()               # (path, callback)
+        self._prefetch = deque()
+        self._thread = None
+
+    def get(self, path):
+        """キャッシュにあれば返す（ファイルが変わっていれば None）"""
+        with self._cond:
+            s = self._cache.get(path)
+            if s is None:
+                return None
+        if s.signature != file_signature(path):
+            return None
+        with self._cond:
+            if path in self._cache:
+                self._cache.move_to_end(path)
+        return s
+
+    def request(self, path, callback):
+        s = self.get(path)
+        if s is not None:
+            callback(s)
+            return
+        with self._cond:
+            self._urgent.append((path, callback))
+            self._ensure_thread()
+            self._cond.notify()
+
+    def prefetch(self, paths):
+        with self._cond:
+            self._prefetch.clear()
+            self._prefetch.extend(p for p in paths if p and p not in self._cache)
+            if self._prefetch:
+                self._ensure_thread()
+                self._cond.notify()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="preview-loader", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._urgent and not self._prefetch:
+                    self._cond.wait()
+                if self._urgent:
+                    path, callback = self._urgent.popleft()
+                else:
+                    path, callback = self._prefetch.popleft(), None
+            s = self.get(path)
+            if s is None:
+                try:
+                    # 明示の試聴は本番と同じキャッシュ経由（そのまま遊べば再解析しない）。先読みはキャッシュを汚さない
+                    song = load_song(path) if callback else MidiSong(path)
+                    s = extract_preview(song, self.seconds)
+                except Exception:
+                    s = None
+                if s is not None:
+                    with self._cond:
+                        self._cache[path] = s
+                        self._cache.move_to_end(path)
+                        while len(self._cache) > self.size:
+                            self._cache.popitem(last=False)
+            if callback is not None and s is not None:
+                try:
+                    callback(s)
+                except Exception:
+                    pass
+
+
+class PreviewPlayer:
+    """
+    試聴の再生。出力はデバイスが変わるまで開いたままにし、曲の切り替えは
+    前の曲を止めて（All Notes Off）すぐ次を鳴らすだけ。
+    """
+    def __init__(self, cache=None, clock=time.perf_counter):
+        self.cache = cache or PreviewCache()
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._out = None
+        self._out_id = None
+        self._player = None
+        self._want = None          # 最後に頼まれた曲（読み込み待ちの間に別の曲が選ばれたら捨てる）
+
+    def play(self, path, device_id):
+        with self._lock:
+            self._want = (path, device_id)
+        self.cache.request(path, lambda s: self._start(s, device_id))
+
+    def stop(self):
+        with self._lock:
+            self._want = None
+            self._stop_player()
+
+    def is_playing(self):
+        with self._lock:
+            return self._player is not None and self._player.is_playing()
+
+    def current_path(self):
+        with self._lock:
+            return self._want[0] if self._want else None
+
+    def close(self):
+        with self._lock:
+            self._want = None
+            self._stop_player()
+            if self._out is not None:
+                self._out.close()
+                self._out = None
+                self._out_id = None
+
+    def _start(self, s, device_id):
+        from midi_utils import open_output_or_none
+        with self._lock:
+            if self._want != (s.path, device_id):
+                return
+            self._stop_player()
+            if self._out is None or self._out_id != device_id:
+                if self._out is not None:
+                    self._out.close()
+                self._out = open_output_or_none(device_id)
+                self._out_id = device_id
+            if self._out is None:
+                return
+            latency = self._out.latency_ms / 1000.0
+            # 先読み済みのぶん（latency）は止めた後の All Notes Off より前に鳴るので、そのあとから始める
+            player = MidiPlayer(s, self._out, latency_ms=self._out.latency_ms, clock=self.clock)
+            player.start(at=self.clock() + latency + _CUTOVER_SEC, offset=s.offset)
+            self._player = player
+
+    def _stop_player(self):
+        player, self._player = self._player, None
+        if player is None:
+            return
+        player.stop()
+        out = self._out
+        if out is not None and out.latency_ms > 0:
+            # タイムスタンプ付きで送り済みの音は止めたあとにも鳴るので、それより後ろにもう一度 All Notes Off
+            from midi_utils import midi_time
+            ts = midi_time() + 1
+            out.write([[[0xB0 | ch, 123, 0], ts] for ch in range(16)])
+
+
+_preview_cache = None
+_preview_cache_lock = threading.Lock()
+
+
+def preview_cache() -> PreviewCache:
+    """プロセスで1つの試聴キャッシュ（ダイアログを開き直しても使い回す）"""
+    global _preview_cache
+    with _preview_cache_lock:
+        if _preview_cache is None:
+            _preview_cache = PreviewCache()
+        return _preview_cache